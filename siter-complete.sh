@@ -1,3 +1,3 @@
 #!/usr/bin/env bash
 
-complete -W "gen new run serve" siter
+complete -W "bench gen new run serve watch" siter
@@ -0,0 +1,145 @@
+"""
+    Copyright 2011 Alex Margarit
+    This file is part of Siter, a static website generator.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License version 3,
+    as published by the Free Software Foundation.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import concurrent.futures, gzip, os
+
+from .cache import *
+from .settings import *
+from .sync import *
+from .util import *
+
+class CAssets:
+    # Output files that get a precompressed .gz sibling
+    GzipExtensions = ('.css', '.html', '.js', '.json', '.svg', '.txt', '.xml')
+
+    # Hex digits of the content hash put in fingerprinted names
+    HashLength = 8
+
+    def __init__(self, Fingerprint, GzipLevel, DigestCache):
+        if GzipLevel < 0 or GzipLevel > 9:
+            CUtil.error(f'Gzip level must be 0 to 9, got {GzipLevel}')
+
+        self.fingerprint = Fingerprint
+        self.gzip_level = GzipLevel
+        self.digests = CDigests(DigestCache)
+        self.compressed = 0
+        self.reused = 0
+
+        # Static file path to the path pages should link to, both with /
+        self.urls = {}
+
+    @staticmethod
+    def binding(Url):
+        # One binding per file, so pages only depend on the files they use
+        return f'{CSettings.Asset}/{Url}'
+
+    def _digest(self, Path, Stat):
+        # Renaming siter-staging to siter-out keeps inodes, so key on those
+        key = (Stat.st_dev, Stat.st_ino, Stat.st_size, Stat.st_mtime_ns)
+
+        return self.digests.digest(key, Path)
+
+    def scan(self, StaticDir):
+        self.urls = {}
+
+        for rootdir, _, files in os.walk(StaticDir.path):
+            for f in files:
+                path = os.path.join(rootdir, f)
+                rel_path = os.path.relpath(path, start = StaticDir.path)
+                url = rel_path.replace(os.sep, '/')
+
+                if self.fingerprint:
+                    name, ext = os.path.splitext(url)
+                    digest = self._digest(path, os.stat(path))
+                    self.urls[url] = \
+                        f'{name}.{digest[: CAssets.HashLength]}{ext}'
+                else:
+                    self.urls[url] = url
+
+    def link(self, DstDir):
+        # Fingerprinted names sit next to the files synced from siter-static
+        for url, hashed_url in self.urls.items():
+            if url != hashed_url:
+                CSync.link(os.path.join(DstDir.path, url),
+                           os.path.join(DstDir.path, hashed_url))
+
+    def _is_same(self, Path, PrevPath):
+        try:
+            stat = os.stat(Path)
+            prev_stat = os.stat(PrevPath)
+        except FileNotFoundError:
+            return False
+
+        if os.path.samestat(stat, prev_stat):
+            return True
+
+        if stat.st_size != prev_stat.st_size:
+            return False
+
+        return self._digest(Path, stat) == self._digest(PrevPath, prev_stat)
+
+    def _compress_file(self, Path, PrevPath):
+        gz_path = f'{Path}.gz'
+        prev_gz_path = f'{PrevPath}.gz'
+
+        if os.path.exists(prev_gz_path) and self._is_same(Path, PrevPath):
+            CSync.link(prev_gz_path, gz_path)
+
+            return False
+
+        with open(Path, 'rb') as f:
+            data = f.read()
+
+        # No timestamp in the header, so the same file compresses the same
+        with open(gz_path, 'wb') as f:
+            f.write(gzip.compress(data, self.gzip_level, mtime = 0))
+
+        return True
+
+    def compress(self, StagingDir, PrevDir, Jobs):
+        if self.gzip_level == 0:
+            return
+
+        CUtil.message('Compress', f'Files in {StagingDir.shortpath}')
+
+        paths = []
+
+        for rootdir, _, files in os.walk(StagingDir.path):
+            rel_dir = os.path.relpath(rootdir, start = StagingDir.path)
+
+            for f in files:
+                # Leave any .gz file that came from siter-static alone
+                if not f.endswith(CAssets.GzipExtensions) \
+                    or f'{f}.gz' in files:
+
+                    continue
+
+                paths.append((os.path.join(rootdir, f),
+                              os.path.normpath(
+                                os.path.join(PrevDir.path, rel_dir, f))))
+
+        # zlib lets go of the GIL while it works, so threads are enough
+        with concurrent.futures.ThreadPoolExecutor(max_workers = Jobs) as pool:
+            for compressed in pool.map(lambda p: self._compress_file(*p),
+                                       paths):
+                if compressed:
+                    self.compressed += 1
+                else:
+                    self.reused += 1
+
+    def evict(self):
+        self.digests.evict()
@@ -0,0 +1,278 @@
+"""
+    Copyright 2011 Alex Margarit
+    This file is part of Siter, a static website generator.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License version 3,
+    as published by the Free Software Foundation.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import json, os, platform, sys, time, tracemalloc
+
+from .file import *
+from .settings import *
+from .tokenizer import *
+from .util import *
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+class CBench:
+    # Shape of the synthetic site, each set by a --bench-<name> option
+    Params = {
+        'pages': 100,
+        'page-size': 40,
+        'depth': 3,
+        'defs': 50,
+        'foreach': 20,
+        'code': 2,
+    }
+
+    # Timed steps of a build, in order
+    Phases = ['tokenize', 'load', 'static', 'generate', 'copy']
+
+    # Report format, bumped if the JSON layout changes
+    Version = 1
+
+    # Slowdowns smaller than this many seconds are noise
+    MinSlowdown = 0.01
+
+    # Same for memory use, in bytes
+    MinGrowth = 1024 * 1024
+
+    @staticmethod
+    def make_project(Path, Params):
+        # Start from the same layout as `siter new`
+        CDirs.new_project(Path)
+
+        os.remove(os.path.join(CSettings.DirPages, 'index.md'))
+
+        os.makedirs(CSettings.DirConfig)
+        os.makedirs(os.path.join(CSettings.DirForeach, 'items'))
+        os.makedirs(os.path.join(CSettings.DirStatic, 'css'))
+
+        def write(Dir, File, Content):
+            with open(os.path.join(Dir, File), 'w') as f:
+                f.write(Content)
+
+        depth = Params['depth']
+        defs = Params['defs']
+        config = []
+
+        # Formatted with % since the text is full of braces
+        for d in range(defs):
+            config.append('{{!siter-def {{def-%d}} '
+                          '{{Definition %d with a few words}}}}\n' % (d, d))
+
+        # Each macro wraps the next one, the last one prints its argument
+        for d in range(depth):
+            if d == depth - 1:
+                body = '<b>{{!text}}</b>'
+            else:
+                body = '<span class="m%d">{{!m%d {{!text}}}}</span>' \
+                            % (d, d + 1)
+
+            config.append('{{!siter-def {{m%d}} {{text}} {{%s}}}}\n'
+                            % (d, body))
+
+        config.append('{{!siter-def {{nav}} {{<nav>'
+                      '<a href="{{!siter-root}}/page-0.html">Home</a>'
+                      '</nav>}}}}\n')
+
+        write(CSettings.DirConfig, 'config.md', ''.join(config))
+
+        write(CSettings.DirTemplate, CSettings.TemplatePage, """\
+<!DOCTYPE html>
+<html lang="en">
+    <head>
+        <meta charset="utf-8">
+        <meta name="generator" content="Siter">
+        <title>{{!title}}</title>
+        <link rel="stylesheet" href="{{!siter-root}}/css/style.css">
+    </head>
+    <body>
+        {{!nav}}
+        {{!siter-md {{!siter-content}}}}
+        <footer>{{!siter-datefmt {{!siter-modified}} {{%b %Y}}}}</footer>
+    </body>
+</html>
+""")
+
+        write(CSettings.DirTemplate, 'item.html', """\
+<article>
+    <h2>{{!siter-name}}</h2>
+    {{!siter-md {{!siter-content}}}}
+</article>
+""")
+
+        for i in range(Params['foreach']):
+            write(os.path.join(CSettings.DirForeach, 'items'),
+                  f'item-{i:04}.md',
+                  'Item %d with **bold** text in {{!siter-root}}\n' % i)
+
+        size = Params['page-size']
+        code = Params['code']
+
+        for p in range(Params['pages']):
+            lines = ['{{!siter-def {{title}} {{Page %d}}}}\n' % p,
+                     '# Page %d\n\n' % p]
+
+            for n in range(size):
+                line = f'Paragraph {n} of page {p}, with *some* words'
+
+                if defs > 0:
+                    line += ' and {{!def-%d}}' % ((p + n) % defs)
+
+                if depth > 0:
+                    line += ' and {{!m0 {{word %d}}}}' % n
+
+                lines.append(line + '.\n\n')
+
+                # Spread the code blocks through the page
+                if code > 0 and (n + 1) % max(size // code, 1) == 0 \
+                    and (n + 1) // max(size // code, 1) <= code:
+
+                    lines.append(f'```python\n'
+                                 f'def function_{n}(x):\n'
+                                 f'    return [x * i for i in range({n})]\n'
+                                 f'```\n\n')
+
+            if Params['foreach'] > 0:
+                lines.append('{{!siter-foreach {{items}} {{item.html}} {{10}}}}\n')
+
+            write(CSettings.DirPages, f'page-{p}.md', ''.join(lines))
+
+        write(os.path.join(CSettings.DirStatic, 'css'),
+              'style.css',
+              'body { color: #222; }\n' * 100)
+
+        for s in range(10):
+            write(CSettings.DirStatic, f'asset-{s}.txt', f'Asset {s}\n' * 1000)
+
+    @staticmethod
+    def time_step(Function):
+        # Finer than CUtil.time_step, small sites build fast
+        start = time.perf_counter()
+        Function()
+
+        return round(time.perf_counter() - start, 6)
+
+    @staticmethod
+    def tokenize():
+        # Tokenize every source file, without the token cache
+        trees = []
+
+        for dir_name in [CSettings.DirConfig,
+                         CSettings.DirForeach,
+                         CSettings.DirPages,
+                         CSettings.DirTemplate]:
+
+            for path, _, files in os.walk(dir_name):
+                for name in files:
+                    with open(os.path.join(path, name), 'r') as f:
+                        trees.append(CTokenizer.tokenize(f.read()))
+
+        return trees
+
+    @staticmethod
+    def measure_memory():
+        # Peak resident size of the builds so far, and the bytes held by
+        # the token trees of all the sources
+        if resource:
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+            if sys.platform != 'darwin':
+                # Linux and the BSDs report kilobytes
+                peak *= 1024
+
+        tracemalloc.start()
+        trees = CBench.tokenize()
+        tokens, traced_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        del trees
+
+        if resource is None:
+            # No getrusage on Windows, so the peak while tokenizing, under
+            # its own name so it is never compared against a resident size
+            return {'tokens': tokens, 'peak-traced': traced_peak}
+
+        return {'tokens': tokens, 'peak-rss': peak}
+
+    @staticmethod
+    def report(Params, Options, Runs, Memory):
+        return {
+            'version': CBench.Version,
+            'params': Params,
+            'options': Options,
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            # The fastest run is the least disturbed one
+            'results': {phase: min(times) for phase, times in Runs.items()},
+            'runs': Runs,
+            'memory': Memory,
+        }
+
+    @staticmethod
+    def save(Path, Report):
+        with open(Path, 'w') as f:
+            json.dump(Report, f, indent = 4)
+
+    @staticmethod
+    def load(Path):
+        try:
+            with open(Path, 'r') as f:
+                report = json.load(f)
+        except (OSError, ValueError) as e:
+            CUtil.error(f'Cannot read baseline {Path}: {e}')
+
+        if report.get('version') != CBench.Version:
+            CUtil.error(f'Baseline {Path} is from another Siter version')
+
+        return report
+
+    @staticmethod
+    def compare(Report, Baseline, Tolerance):
+        # Returns text lines and the phases that got slower than allowed
+        lines = []
+        regressions = []
+
+        if Report['params'] != Baseline['params'] \
+            or Report['options'] != Baseline['options']:
+
+            CUtil.warning('Baseline was measured with different settings')
+
+        lines.append(f'{"phase":<10} {"baseline":>10} {"now":>10} {"change":>8}')
+
+        # Seconds per phase, then megabytes of memory
+        sections = [('results', 1, CBench.MinSlowdown, 'SLOWER'),
+                    ('memory', 1024 * 1024, CBench.MinGrowth, 'BIGGER')]
+
+        for section, unit, min_delta, flag in sections:
+            for name, now in Report[section].items():
+                before = Baseline.get(section, {}).get(name)
+
+                if before is None:
+                    continue
+
+                change = (now - before) / before if before > 0 else 0.0
+                line = f'{name:<10} {before / unit:>10.4f} ' \
+                       f'{now / unit:>10.4f} {change:>+8.1%}'
+
+                if change > Tolerance and now - before > min_delta:
+                    regressions.append(name)
+                    line += f'  {flag}'
+
+                lines.append(line)
+
+        return lines, regressions
@@ -15,6 +15,8 @@
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+from .compiler import *
+from .depends import *
 from .settings import *
 from .util import *
 
@@ -22,10 +24,37 @@ class CBinding:
     def __init__(self):
         self.protected = False
 
+    def fingerprint(self):
+        # Identifies the definition, not what it evaluates to
+        try:
+            return self._fingerprint
+        except AttributeError:
+            self._fingerprint = self._make_fingerprint()
+
+            return self._fingerprint
+
+    def compiled(self):
+        try:
+            return self._compiled
+        except AttributeError:
+            self._compiled = CCompiler.compile(self.tokens)
+
+            return self._compiled
+
+    def __getstate__(self):
+        # Compiled code can not be pickled, it is made again when needed
+        state = dict(self.__dict__)
+        state.pop('_compiled', None)
+
+        return state
+
 class CBindingVariable(CBinding):
     def __init__(self, Tokens):
         self.tokens = Tokens
 
+    def _make_fingerprint(self):
+        return ('variable', self.tokens.resolve())
+
 class CBindingMacro(CBinding):
     def __init__(self, Siter, Params, Tokens):
         num_required = len(Params)
@@ -43,27 +72,96 @@ class CBindingMacro(CBinding):
         self.num_params_req = num_required
         self.tokens = Tokens
 
+    def _make_fingerprint(self):
+        return ('macro',
+                tuple(self.params),
+                self.num_params_req,
+                self.tokens.resolve())
+
 class CBindingFunction(CBinding):
-    def __init__(self, NumParams, Func, Lazy):
+    def __init__(self, NumParams, Func, Lazy, Pure):
         self.num_params = NumParams
         self.func = Func
         self.lazy = Lazy
 
+        # Output only depends on the args, the bindings it looks up, and the
+        # files it records, and it changes nothing else
+        self.pure = Pure
+
+    def _make_fingerprint(self):
+        return ('function', self.func.__qualname__)
+
 class CBindingCollection:
     def __init__(self, Siter):
         self.siter = Siter
-        self.bindings = {}
-        self.stack = []
+        self.records = []
+
+        # Scope chain, globals first; inner frames shadow outer ones
+        self.frames = [{}]
+
+    def record_begin(self, Depth = None):
+        # Record lookups that resolve outside of the current frames
+        if Depth is None:
+            Depth = len(self.frames)
+
+        record = CDependencyRecord(Depth)
+        self.records.append(record)
+
+        return record
+
+    def record_end(self):
+        record = self.records.pop()
+
+        if self.records:
+            self.records[-1].merge(record)
+
+        return record
+
+    def get_fingerprint(self, Name):
+        # Fingerprint of the global binding, ignoring any pushed frames
+        binding = self.frames[0].get(Name)
+
+        return binding.fingerprint() if binding else None
+
+    def _find(self, Name):
+        for index in range(len(self.frames) - 1, -1, -1):
+            binding = self.frames[index].get(Name)
+
+            if binding is not None:
+                return index, binding
+
+        return -1, None
+
+    def _lookup(self, Name):
+        index, binding = self._find(Name)
+
+        if self.records:
+            record = self.records[-1]
+
+            if index < record.depth and Name not in record.bindings:
+                record.bindings[Name] = \
+                    (index, binding.fingerprint() if binding else None)
+
+        return binding
+
+    def find(self, Name):
+        return self._lookup(Name)
+
+    def peek(self, Name):
+        # Like find, without making the binding a dependency
+        return self._find(Name)[1]
 
     def contains(self, Name):
-        return Name in self.bindings
+        return self._lookup(Name) is not None
 
     def _add(self, Name, Binding, Protected):
-        if self.contains(Name) and self.get(Name).protected:
+        _, current = self._find(Name)
+
+        if current is not None and current.protected:
             CUtil.error(f'Cannot overwrite binding {Name}')
 
         Binding.protected = Protected
-        self.bindings[Name] = Binding
+        self.frames[-1][Name] = Binding
 
     def add_variable(self, Name, Tokens, Protected = False):
         binding = CBindingVariable(Tokens)
@@ -74,18 +172,29 @@ class CBindingCollection:
         self._add(Name, binding, Protected)
 
     def add_function(self, Name, NumParams, Func,
-                     Protected = False, Lazy = False):
-        binding = CBindingFunction(NumParams, Func, Lazy)
+                     Protected = False, Lazy = False, Pure = False):
+        binding = CBindingFunction(NumParams, Func, Lazy, Pure)
         self._add(Name, binding, Protected)
 
+    def get_globals(self):
+        return dict(self.frames[0])
+
+    def add_globals(self, Bindings):
+        self.frames[0].update(Bindings)
+
+    def remove(self, Name):
+        self.frames[-1].pop(Name, None)
+
     def get(self, Name):
-        if Name not in self.bindings:
+        binding = self._lookup(Name)
+
+        if binding is None:
             CUtil.error(f'{Name} not in bindings')
 
-        return self.bindings[Name]
+        return binding
 
     def push(self):
-        self.stack.append(self.bindings.copy())
+        self.frames.append({})
 
     def pop(self):
-        self.bindings = self.stack.pop()
+        self.frames.pop()
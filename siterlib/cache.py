@@ -0,0 +1,140 @@
+"""
+    Copyright 2011 Alex Margarit
+    This file is part of Siter, a static website generator.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License version 3,
+    as published by the Free Software Foundation.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import hashlib, os, pickle, shutil, tempfile
+
+from .settings import *
+from .util import *
+
+class CCache:
+    # Bump to invalidate every cache after a format change
+    Version = 1
+
+    _version_file = 'version'
+
+    def __init__(self, Name, Version, Enabled = True, Lru = False):
+        self.path = os.path.join(CSettings.DirCache, Name)
+        self.enabled = Enabled
+        self.lru = Lru
+        self.hits = 0
+        self.misses = 0
+
+        if not self.enabled:
+            return
+
+        version = f'{CCache.Version}.{Version}'
+        version_path = os.path.join(self.path, CCache._version_file)
+
+        try:
+            with open(version_path, 'r') as f:
+                valid = f.read() == version
+        except FileNotFoundError:
+            valid = False
+
+        if not valid:
+            # Stale or missing cache, start over
+            shutil.rmtree(self.path, ignore_errors = True)
+            os.makedirs(self.path)
+
+            with open(version_path, 'w') as f:
+                f.write(version)
+
+    @staticmethod
+    def digest(Text):
+        if type(Text) is str:
+            Text = Text.encode()
+
+        return hashlib.sha1(Text).hexdigest()
+
+    def _entry_path(self, Key):
+        return os.path.join(self.path, CCache.digest(repr(Key)))
+
+    def get(self, Key, IsFresh = None):
+        if not self.enabled:
+            return None
+
+        entry_path = self._entry_path(Key)
+
+        try:
+            with open(entry_path, 'rb') as f:
+                key, value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            key = None
+
+        if key != Key or (IsFresh and not IsFresh(value)):
+            self.misses += 1
+
+            return None
+
+        self.hits += 1
+
+        if self.lru:
+            # Mark as recently used for trim
+            try:
+                os.utime(entry_path)
+            except OSError:
+                pass
+
+        return value
+
+    def set(self, Key, Value):
+        if not self.enabled:
+            return
+
+        # Write to a temp file first so readers never see a partial entry
+        fd, temp_path = tempfile.mkstemp(dir = self.path, suffix = '.tmp')
+
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump((Key, Value), f, pickle.HIGHEST_PROTOCOL)
+
+        os.replace(temp_path, self._entry_path(Key))
+
+    def evict(self, LiveKeys):
+        if not self.enabled:
+            return
+
+        live = {os.path.basename(self._entry_path(k)) for k in LiveKeys}
+        live.add(CCache._version_file)
+
+        for entry in os.scandir(self.path):
+            if entry.name not in live:
+                os.remove(entry.path)
+
+    def trim(self, MaxBytes):
+        if not self.enabled:
+            return
+
+        entries = []
+        total = 0
+
+        for entry in os.scandir(self.path):
+            if entry.name != CCache._version_file:
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+
+        # Drop the least recently used entries first
+        for _, size, path in sorted(entries):
+            if total <= MaxBytes:
+                break
+
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+            total -= size
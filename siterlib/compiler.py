@@ -0,0 +1,88 @@
+"""
+    Copyright 2011 Alex Margarit
+    This file is part of Siter, a static website generator.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License version 3,
+    as published by the Free Software Foundation.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from .token import *
+
+class CCompiler:
+    def _flatten(Collection, Ops):
+        for token in Collection:
+            if type(token) is CTokenBlock:
+                name = token.capture_call()
+
+                if name is None:
+                    # Plain blocks evaluate to their contents, untrimmed
+                    CCompiler._flatten(token.tokens, Ops)
+                else:
+                    Ops.append((name, token))
+            else:
+                Ops.append(token)
+
+    def compile(Collection):
+        tokens = Collection.tokens
+
+        if CTokenBlock not in map(type, tokens):
+            # Already evaluated, like macro arguments
+            def copy(Siter, Write = None):
+                if Write:
+                    for token in tokens:
+                        Write(token.resolve())
+
+                    return CTokenCollection()
+
+                return CTokenCollection(list(tokens))
+
+            return copy
+
+        flat_ops = []
+        CCompiler._flatten(Collection, flat_ops)
+
+        # Steps are (static tokens, None, None) or (None, name, block)
+        ops = []
+        static = []
+
+        for op in flat_ops:
+            if type(op) is tuple:
+                if static:
+                    ops.append((CTokenCollection.join_static(static), None, None))
+                    static = []
+
+                ops.append((None, op[0], op[1]))
+            else:
+                static.append(op)
+
+        if static:
+            ops.append((CTokenCollection.join_static(static), None, None))
+
+        def run(Siter, Write = None):
+            tokens = []
+
+            for static, name, block in ops:
+                if name is None:
+                    result = static
+                else:
+                    result = Siter.evaluate_call(name, block).tokens
+
+                if Write:
+                    # Hand over each step's text instead of keeping it
+                    for token in result:
+                        Write(token.resolve())
+                else:
+                    tokens += result
+
+            return CTokenCollection(tokens)
+
+        return run
@@ -0,0 +1,111 @@
+"""
+    Copyright 2011 Alex Margarit
+    This file is part of Siter, a static website generator.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License version 3,
+    as published by the Free Software Foundation.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from .cache import *
+from .settings import *
+
+class CDependencyRecord:
+    def __init__(self, Depth):
+        # Only record bindings found in frames below this one
+        self.depth = Depth
+
+        # Binding name to (frame index, fingerprint), or (-1, None) if undefined
+        self.bindings = {}
+
+        # File shortpath to its fingerprint
+        self.files = {}
+
+        # Dir path to the names of the files it had
+        self.dirs = {}
+
+        # How many numbered output files the page made
+        self.outputs = 1
+
+    def merge(self, Other):
+        for name, entry in Other.bindings.items():
+            if entry[0] < self.depth:
+                self.bindings.setdefault(name, entry)
+
+        self.merge_files(Other)
+
+    def merge_files(self, Other):
+        self.files.update(Other.files)
+        self.dirs.update(Other.dirs)
+
+    def is_fresh(self, Siter, Scoped = False):
+        for name, (_, fingerprint) in self.bindings.items():
+            if Scoped:
+                # Stubs also read bindings from the page that lists them
+                binding = Siter.bindings.peek(name)
+                current = binding.fingerprint() if binding else None
+            else:
+                current = Siter.bindings.get_fingerprint(name)
+
+            if current != fingerprint:
+                return False
+
+        for path, fingerprint in self.files.items():
+            text_file = Siter.dirs.find_file(path)
+
+            if text_file is None or text_file.fingerprint() != fingerprint:
+                return False
+
+        for path, names in self.dirs.items():
+            if Siter.dirs.find_dir_names(path) != names:
+                return False
+
+        return True
+
+class CDependencyGraph:
+    # Bump when what gets recorded changes
+    Version = 3
+
+    def __init__(self, Enabled, Setup = None):
+        # Output made with other options can not be carried over
+        self.key = ('pages', Setup)
+        self.cache = CCache('depends', CDependencyGraph.Version, Enabled)
+        self.previous = self.cache.get(self.key) or {}
+        self.pages = {}
+
+    def is_fresh(self, Siter, Page):
+        record = self.previous.get(Page.shortpath)
+
+        if record is None or not record.is_fresh(Siter):
+            return False
+
+        # Still valid for next time
+        self.pages[Page.shortpath] = record
+
+        return True
+
+    def outputs(self, Page):
+        return self.pages[Page.shortpath].outputs
+
+    def advance(self):
+        # The last build is now the previous one
+        self.previous = self.pages
+        self.pages = {}
+
+    def rollback(self):
+        # Forget a failed build, what was saved last still matches siter-out
+        self.pages = self.cache.get(self.key) or {}
+
+    def set(self, Page, Record):
+        self.pages[Page.shortpath] = Record
+
+    def save(self):
+        self.cache.set(self.key, self.pages)
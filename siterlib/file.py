@@ -15,9 +15,13 @@
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-import enum, os, shutil
+import enum, os, shutil, time
 
+from .cache import *
+from .compiler import *
+from .profile import *
 from .settings import *
+from .sync import *
 from .tokenizer import *
 from .util import *
 
@@ -41,14 +45,22 @@ class CFile:
     def get_mod_time(self):
         return os.stat(self.path).st_mtime
 
+    def get_mod_date(self):
+        return time.strftime('%Y-%m-%d', time.localtime(self.get_mod_time()))
+
 class CDir(CFile):
-    def __init__(self, Path, Mode, ReadContents, AllowedExtension):
+    def __init__(self, Path, Mode, ReadContents, AllowedExtension,
+                 Cache = None, Setup = True, Previous = None):
         CFile.__init__(self, Path, Mode)
 
         self.files = {}
         self.dirs = {}
+        self._indexes = {}
 
-        if self.mode is CFileMode.Create:
+        if not Setup:
+            # Somebody else already created or reset this dir
+            pass
+        elif self.mode is CFileMode.Create:
             os.makedirs(self.path, exist_ok = True)
         elif self.mode is CFileMode.Reset:
             try:
@@ -64,11 +76,24 @@ class CDir(CFile):
 
                 for f in filter(lambda f: f.endswith(AllowedExtension), files):
                     full_path = os.path.join(rootdir, f)
-                    text_file = CTextFile(Path, full_path, CFileMode.Required)
+                    text_file = Previous.find_file(full_path) \
+                                    if Previous else None
+
+                    if text_file is None or text_file.is_changed():
+                        text_file = CTextFile(
+                                        Path, full_path, CFileMode.Required, Cache)
+                    else:
+                        text_file.set_cache(Cache)
 
                     self.files[full_path] = text_file
                     self.dirs[rootdir].append(text_file)
 
+    def find_file(self, Path):
+        return self.files.get(Path)
+
+    def find_dir(self, Path):
+        return self.dirs.get(Path)
+
     def get_dir_files(self, RelDirPath):
         path = os.path.join(self.path, RelDirPath)
 
@@ -77,6 +102,21 @@ class CDir(CFile):
         except KeyError:
             CUtil.error(f'Dir {path} not found')
 
+    def get_dir_index(self, RelDirPath):
+        # Newest first by file name, sorted once per build
+        try:
+            return self._indexes[RelDirPath]
+        except KeyError:
+            pass
+
+        index = sorted(self.get_dir_files(RelDirPath),
+                       key = lambda f: f.name,
+                       reverse = True)
+
+        self._indexes[RelDirPath] = index
+
+        return index
+
     def get_files(self):
         return self.files.values()
 
@@ -91,45 +131,274 @@ class CDir(CFile):
     def path_to(self, Target):
         return os.path.relpath(Target.path, start = self.path)
 
-    def copy_to(self, DstDir):
-        CUtil.message('Copy files',
-                      f'From {self.shortpath} to {DstDir.shortpath}')
+    def replace(self, DstDir):
+        CUtil.message('Move', f'From {self.shortpath} to {DstDir.shortpath}')
 
-        shutil.rmtree(DstDir.path)
+        # Swap dirs with renames, so DstDir is never partly written
+        old_path = f'{DstDir.path}.old'
+        shutil.rmtree(old_path, ignore_errors = True)
 
         try:
-            shutil.copytree(self.path, DstDir.path)
+            os.replace(DstDir.path, old_path)
         except FileNotFoundError:
             pass
 
-    def replace(self, DstDir):
-        CUtil.message('Move', f'From {self.shortpath} to {DstDir.shortpath}')
-
-        shutil.rmtree(DstDir.path)
         os.replace(self.path, DstDir.path)
+        shutil.rmtree(old_path, ignore_errors = True)
 
 class CTextFile(CFile):
-    def __init__(self, Prefix, Path, Mode):
+    def __init__(self, Prefix, Path, Mode, Cache = None):
         CFile.__init__(self, Path, Mode)
-        CUtil.message('Load', self.shortpath)
 
         path_public, _ = os.path.splitext(os.path.relpath(Path, start = Prefix))
         self.path_public = f'{path_public}.html'
 
-        with open(self.path, 'rU') as f:
-            self.tokens = CTokenizer.tokenize(f.read())
+        # Contents are only read once something asks for them
+        self._cache = Cache
+        self._digest = None
+        self._tokens = None
+        self.stat_key = None
+
+    def _load(self):
+        # Cache entries are (size, mtime, content digest, tokens)
+        CUtil.message('Load', self.shortpath)
+
+        cache = self._cache
+        stat = os.stat(self.path)
+        text = None
+
+        self.stat_key = (stat.st_size, stat.st_mtime_ns)
+
+        def read():
+            nonlocal text
+
+            with open(self.path, 'r') as f:
+                text = f.read()
+
+            self._digest = CCache.digest(text)
+
+        def is_fresh(Entry):
+            if Entry[0] != stat.st_size or Entry[1] != stat.st_mtime_ns:
+                # Touched, but maybe not changed
+                read()
+
+                return self._digest == Entry[2]
+
+            return True
+
+        entry = cache.get(self.shortpath, is_fresh) if cache else None
+
+        if entry:
+            self._digest = entry[2]
+            self._tokens = entry[3]
+
+            if text is None:
+                return
+        else:
+            if text is None:
+                read()
+
+            with CProfiler.span('phase', 'tokenize'):
+                self._tokens = CTokenizer.tokenize(text)
+
+        if cache:
+            cache.set(self.shortpath,
+                      (stat.st_size, stat.st_mtime_ns, self._digest, self._tokens))
+
+    def set_cache(self, Cache):
+        # A file kept from the last build loads through the current cache
+        self._cache = Cache
+
+    def get_tokens(self):
+        if self._tokens is None:
+            self._load()
+
+        return self._tokens
+
+    def get_digest(self):
+        if self._digest is None:
+            # Hashing the text is cheaper than loading cached tokens
+            stat = os.stat(self.path)
+
+            with open(self.path, 'r') as f:
+                self._digest = CCache.digest(f.read())
+
+            self.stat_key = (stat.st_size, stat.st_mtime_ns)
+
+        return self._digest
+
+    def is_changed(self):
+        if self.stat_key is None:
+            # Nothing was read yet, so nothing can be out of date
+            return False
+
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return True
+
+        return self.stat_key != (stat.st_size, stat.st_mtime_ns)
+
+    def fingerprint(self):
+        return (self.get_digest(), self.get_mod_date())
+
+    def compiled(self):
+        try:
+            return self._compiled
+        except AttributeError:
+            self._compiled = CCompiler.compile(self.get_tokens())
+
+            return self._compiled
 
     def path_to(self, Target):
         return os.path.relpath(Target.path, start = os.path.dirname(self.path))
 
-    def write(self, Text, WriteRoot, ReadRoot):
+    @staticmethod
+    def numbered_name(Name, Number):
+        # Page 1 keeps the plain name, the others are name-2, name-3, ...
+        return Name if Number == 1 else f'{Name}-{Number}'
+
+    def out_path(self, WriteRoot, ReadRoot, Number = 1):
         out_dir = os.path.join(WriteRoot.path,
                                os.path.dirname(ReadRoot.path_to(self)))
+        name = CTextFile.numbered_name(self.name_noext, Number)
+
+        return os.path.join(out_dir, f'{name}.html')
+
+    def open_writer(self, WriteRoot, ReadRoot, PrevRoot = None, Number = 1,
+                    Minify = None):
+        prev_path = self.out_path(PrevRoot, ReadRoot, Number) \
+                        if PrevRoot else None
 
-        os.makedirs(out_dir, exist_ok = True)
+        return CPageWriter(self.out_path(WriteRoot, ReadRoot, Number),
+                           prev_path,
+                           Minify)
 
-        with open(os.path.join(out_dir, f'{self.name_noext}.html'), 'w') as f:
-            f.write(Text)
+    def carry(self, PrevRoot, WriteRoot, ReadRoot, Count = 1):
+        # Reuse the previous output files, if they are all there
+        paths = [(self.out_path(PrevRoot, ReadRoot, n),
+                  self.out_path(WriteRoot, ReadRoot, n))
+                    for n in range(1, Count + 1)]
+
+        if not all(os.path.isfile(prev_path) for prev_path, _ in paths):
+            return False
+
+        CUtil.message('Unchanged', self.shortpath)
+
+        for prev_path, out_path in paths:
+            os.makedirs(os.path.dirname(out_path), exist_ok = True)
+            CSync.link(prev_path, out_path)
+
+        return True
+
+class CPageWriter:
+    # Collect this many chars before comparing and writing them
+    BufferSize = 64 * 1024
+
+    def __init__(self, OutPath, PrevPath = None, Minify = None):
+        self.out_path = OutPath
+        self.prev_path = PrevPath
+        self.minify = Minify
+        self.saved = 0
+
+        self._file = None
+        self._prev = None
+        self._matched = 0
+        self._pieces = []
+        self._size = 0
+
+        os.makedirs(os.path.dirname(OutPath), exist_ok = True)
+
+        if PrevPath:
+            try:
+                self._prev = open(PrevPath, 'r', newline = '')
+            except OSError:
+                pass
+
+        if self._prev is None:
+            self._file = self._open_out()
+
+    def write(self, Text):
+        self._pieces.append(Text)
+        self._size += len(Text)
+
+        # Minifying needs the whole page
+        if self._size >= CPageWriter.BufferSize and not self.minify:
+            self._flush()
+
+    def _flush(self):
+        text = ''.join(self._pieces)
+        self._pieces = []
+        self._size = 0
+
+        if self._file is None:
+            # Nothing written while the page matches the previous one
+            try:
+                is_same = self._prev.read(len(text)) == text
+            except UnicodeDecodeError:
+                is_same = False
+
+            if is_same:
+                self._matched += len(text)
+
+                return
+
+            self._diverge()
+
+        self._file.write(text)
+
+    def _open_out(self):
+        # A page can have the same name as a file from siter-static
+        CSync.unlink(self.out_path)
+
+        return open(self.out_path, 'w')
+
+    def _diverge(self):
+        # Copy over the part that matched, then write from here on
+        self._file = self._open_out()
+        self._prev.seek(0)
+        left = self._matched
+
+        while left > 0:
+            chunk = self._prev.read(min(left, CPageWriter.BufferSize))
+            self._file.write(chunk)
+            left -= len(chunk)
+
+        self._prev.close()
+        self._prev = None
+
+    def close(self):
+        # Returns False if the page is the same as the previous one
+        if self.minify:
+            text = ''.join(self._pieces)
+            minified = self.minify(text)
+            self._pieces = [minified]
+            self.saved = len(text.encode()) - len(minified.encode())
+
+        self._flush()
+
+        if self._file is None:
+            # The previous page may also be longer
+            try:
+                is_same = self._prev.read(1) == ''
+            except UnicodeDecodeError:
+                is_same = False
+
+            if not is_same:
+                self._diverge()
+
+        if self._prev:
+            self._prev.close()
+
+        if self._file:
+            self._file.close()
+
+            return True
+
+        # Keep the previous file and its mtime
+        CSync.link(self.prev_path, self.out_path)
+
+        return False
 
 class CDirs:
     _index = {
@@ -144,16 +413,73 @@ class CDirs:
         CSettings.DirStaging: (CFileMode.Reset, False, ''),
     }
 
-    def __init__(self):
+    def __init__(self, TokenCache = None, Setup = True, Previous = None):
         self.dirs = {}
 
         for dir_entry in CDirs._index:
             mode, read, allowed_ext = CDirs._index[dir_entry]
-            self.dirs[dir_entry] = CDir(dir_entry, mode, read, allowed_ext)
+            self.dirs[dir_entry] = CDir(dir_entry,
+                                        mode,
+                                        read,
+                                        allowed_ext,
+                                        TokenCache,
+                                        Setup,
+                                        Previous.get(dir_entry)
+                                            if Previous else None)
+
+        if TokenCache and Setup:
+            # Forget files that are not in the project anymore
+            TokenCache.evict([f.shortpath for d in self.dirs.values()
+                                            for f in d.get_files()])
 
     def get(self, Id):
         return self.dirs[Id]
 
+    def find_file(self, ShortPath):
+        path = os.path.abspath(ShortPath)
+
+        for d in self.dirs.values():
+            text_file = d.find_file(path)
+
+            if text_file:
+                return text_file
+
+        return None
+
+    def find_dir_names(self, ShortPath):
+        path = os.path.abspath(ShortPath)
+
+        for d in self.dirs.values():
+            files = d.find_dir(path)
+
+            if files is not None:
+                return sorted(f.name for f in files)
+
+        return None
+
+    @staticmethod
+    def snapshot():
+        # Size and mtime of every source file, to notice changes
+        files = {}
+
+        for dir_entry in CDirs._index:
+            if CDirs._index[dir_entry][0] in [CFileMode.Create,
+                                              CFileMode.Reset]:
+                continue
+
+            for rootdir, _, names in os.walk(dir_entry):
+                for name in names:
+                    path = os.path.join(rootdir, name)
+
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+
+                    files[path] = (stat.st_size, stat.st_mtime_ns)
+
+        return files
+
     @staticmethod
     def validate():
         for dir_entry in CDirs._index:
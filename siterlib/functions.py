@@ -15,9 +15,12 @@
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-import time
+import os, time
 
+from .assets import *
+from .cache import *
 from .file import *
+from .profile import *
 from .settings import *
 from .token import *
 from .util import *
@@ -68,12 +71,32 @@ class CFunctions:
 
     @staticmethod
     def markdown(Siter, Args):
-        return Siter.md.reset().convert(Args[0])
+        key = (Siter.md_config, CCache.digest(Args[0]))
+        html = Siter.md_cache.get(key)
+
+        if html is None:
+            with CProfiler.span('phase', 'markdown'):
+                html = Siter.md.reset().convert(Args[0])
+            Siter.md_cache.set(key, html)
+
+        return html
 
     @staticmethod
     def anchor(_, Args):
         return Args[0].lower().replace(' ', '-')
 
+    @staticmethod
+    def asset(Siter, Args):
+        url = Args[0].strip().lstrip('/')
+        binding = Siter.bindings.find(CAssets.binding(url))
+
+        if binding is None:
+            CUtil.error(f'{url} not in {CSettings.DirStatic}')
+
+        root = Siter.bindings.get(CSettings.Root).tokens.resolve()
+
+        return f'{root}/{binding.tokens.resolve()}'
+
     @staticmethod
     def foreach(Siter, Args):
         a_stubs_dir = Args[0]
@@ -82,10 +105,10 @@ class CFunctions:
 
         template_file = Siter.dirs.get(CSettings.DirTemplate) \
                             .get_file(a_template)
-        stub_files = sorted(Siter.dirs.get(CSettings.DirForeach)
-                                .get_dir_files(a_stubs_dir),
-                            key = lambda f: f.name,
-                            reverse = True)
+
+        Siter.record_dir(os.path.join(CSettings.DirForeach, a_stubs_dir))
+        stub_files = Siter.dirs.get(CSettings.DirForeach) \
+                        .get_dir_index(a_stubs_dir)
 
         if len(Args) == 3:
             try:
@@ -96,5 +119,54 @@ class CFunctions:
         if a_num_max > 0:
             stub_files = stub_files[: a_num_max]
 
-        return ''.join([Siter.process_file(f, template_file, True)
-                            for f in stub_files])
+        # Separate strings, so pages write them out without joining them
+        # first. They are all made before the page template runs, since
+        # stubs only render while a page's siter-content is evaluated
+        return [Siter.process_file(f, template_file, True)
+                    for f in stub_files]
+
+    @staticmethod
+    def paginate(Siter, Args):
+        a_stubs_dir = Args[0]
+        a_template = Args[1]
+        a_page_size = 10
+
+        if len(Args) == 3:
+            try:
+                a_page_size = int(Args[2])
+            except ValueError:
+                CUtil.error(f'"{Args[2]}" is not an integer')
+
+            if a_page_size < 1:
+                CUtil.error(f'Page size must be at least 1, got {a_page_size}')
+
+        template_file = Siter.dirs.get(CSettings.DirTemplate) \
+                            .get_file(a_template)
+
+        Siter.record_dir(os.path.join(CSettings.DirForeach, a_stubs_dir))
+        stub_files = Siter.dirs.get(CSettings.DirForeach) \
+                        .get_dir_index(a_stubs_dir)
+
+        number = int(Siter.bindings.get(CSettings.PageNumber).tokens.resolve())
+        name = Siter.bindings.get(CSettings.Name).tokens.resolve()
+        count = max(1, -(-len(stub_files) // a_page_size))
+
+        def page_url(Number):
+            if Number < 1 or Number > count:
+                return ''
+
+            return f'{CTextFile.numbered_name(name, Number)}.html'
+
+        # Tells the page generator how many numbered pages to make
+        Siter.page_count = count
+
+        for binding, value in [(CSettings.PageCount, str(count)),
+                               (CSettings.PagePrev, page_url(number - 1)),
+                               (CSettings.PageNext, page_url(number + 1))]:
+
+            Siter.bindings.add_variable(binding, CTokenizer.text(value))
+
+        start = (number - 1) * a_page_size
+
+        return [Siter.process_file(f, template_file, True)
+                    for f in stub_files[start : start + a_page_size]]
@@ -0,0 +1,91 @@
+"""
+    Copyright 2011 Alex Margarit
+    This file is part of Siter, a static website generator.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License version 3,
+    as published by the Free Software Foundation.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import collections
+
+from .token import *
+
+class CMemo:
+    # Remember this many expansions of the same macro and arguments
+    MaxVariants = 8
+
+    def __init__(self, Size):
+        self.size = Size
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def arg_key(Collection):
+        # Same text and same trimmable whitespace evaluate the same way
+        tokens = Collection.tokens
+        lead = 0
+        trail = 0
+
+        for t in tokens:
+            if type(t) is not CTokenWhitespace:
+                break
+
+            lead += len(t.resolve())
+
+        for t in reversed(tokens):
+            if type(t) is not CTokenWhitespace:
+                break
+
+            trail += len(t.resolve())
+
+        return (Collection.resolve(), lead, trail)
+
+    def get(self, Siter, Key):
+        variants = self.entries.get(Key)
+
+        if variants:
+            self.entries.move_to_end(Key)
+
+            for record, tokens in variants:
+                # The free bindings the expansion read must not have changed
+                for name, (_, fingerprint) in record.bindings.items():
+                    binding = Siter.bindings.find(name)
+
+                    if (binding.fingerprint() if binding else None) \
+                        != fingerprint:
+
+                        break
+                else:
+                    self.hits += 1
+
+                    # Checking the bindings above already recorded them
+                    if Siter.bindings.records:
+                        Siter.bindings.records[-1].merge_files(record)
+
+                    return CTokenCollection(list(tokens))
+
+        self.misses += 1
+
+        return None
+
+    def set(self, Key, Record, Collection):
+        variants = self.entries.setdefault(Key, [])
+        variants.append((Record, list(Collection.tokens)))
+
+        if len(variants) > CMemo.MaxVariants:
+            del variants[0]
+
+        self.entries.move_to_end(Key)
+
+        if len(self.entries) > self.size:
+            self.entries.popitem(last = False)
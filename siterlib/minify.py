@@ -0,0 +1,130 @@
+"""
+    Copyright 2011 Alex Margarit
+    This file is part of Siter, a static website generator.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License version 3,
+    as published by the Free Software Foundation.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os, re, shutil
+
+class CMinify:
+    # Whitespace is kept as is in pre and textarea, which includes code
+    # highlighted by siter-md, and in tags, so attribute values stay the
+    # same; script and style get their own minifiers
+    _html_re = re.compile(r'(<(pre|textarea)\b.*?</\2\s*>)'
+                          r'|(<script\b[^>]*>)(.*?)(</script\s*>)'
+                          r'|(<style\b[^>]*>)(.*?)(</style\s*>)'
+                          r'|(<!--(?!\[if).*?-->)'
+                          r'|(<[a-zA-Z/!](?:"[^"]*"|\'[^\']*\'|[^\'">])*>)'
+                          r'|(\s+)',
+                          re.DOTALL | re.IGNORECASE)
+
+    _css_re = re.compile(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')'
+                         r'|(/\*(?!!).*?\*/)'
+                         r'|\s*([{};,>])\s*'
+                         r'|:\s+'
+                         r'|(\s+)',
+                         re.DOTALL)
+
+    @staticmethod
+    def _html_sub(Match):
+        if Match.group(1):
+            return Match.group(1)
+        elif Match.group(3):
+            return Match.group(3) + CMinify.js(Match.group(4)) + Match.group(5)
+        elif Match.group(6):
+            return Match.group(6) + CMinify.css(Match.group(7)) \
+                    + Match.group(8)
+        elif Match.group(9):
+            return ''
+        elif Match.group(10):
+            return Match.group(10)
+
+        # Browsers collapse whitespace runs anyway, keep line breaks as such
+        return '\n' if '\n' in Match.group(11) else ' '
+
+    @staticmethod
+    def html(Text):
+        return CMinify._html_re.sub(CMinify._html_sub, Text).strip()
+
+    @staticmethod
+    def _css_sub(Match):
+        if Match.group(1):
+            return Match.group(1)
+        elif Match.group(2):
+            return ''
+        elif Match.group(3):
+            return Match.group(3)
+        elif Match.group(4):
+            return ' '
+
+        return ':'
+
+    @staticmethod
+    def css(Text):
+        return CMinify._css_re.sub(CMinify._css_sub, Text).strip()
+
+    @staticmethod
+    def js(Text):
+        # Template literals can span lines, leave those scripts alone
+        if '`' in Text:
+            return Text
+
+        lines = []
+        continued = False
+
+        for line in Text.split('\n'):
+            # A line after a backslash continues a string literal
+            line = line.rstrip() if continued else line.strip()
+
+            if line:
+                lines.append(line)
+
+            continued = line.endswith('\\')
+
+        return '\n'.join(lines)
+
+    _by_extension = {
+        '.css': 'css',
+        '.htm': 'html',
+        '.html': 'html',
+        '.js': 'js',
+    }
+
+    @staticmethod
+    def for_path(Path):
+        name = CMinify._by_extension.get(os.path.splitext(Path)[1].lower())
+
+        return getattr(CMinify, name) if name else None
+
+    @staticmethod
+    def minify_file(Paths):
+        # Returns bytes saved, and the stat of the file written
+        src_path, dst_path = Paths
+
+        with open(src_path, 'rb') as f:
+            data = f.read()
+
+        try:
+            text = CMinify.for_path(src_path)(data.decode())
+            minified = text.encode()
+        except UnicodeDecodeError:
+            minified = data
+
+        with open(dst_path, 'wb') as f:
+            f.write(minified)
+
+        # Same mtime as the source, like a copy
+        shutil.copystat(src_path, dst_path)
+
+        return len(data) - len(minified), os.stat(dst_path)
@@ -0,0 +1,152 @@
+"""
+    Copyright 2011 Alex Margarit
+    This file is part of Siter, a static website generator.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License version 3,
+    as published by the Free Software Foundation.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import contextlib, json, os, time
+
+from .util import *
+
+class CProfiler:
+    # Off unless --profile is on; the hot paths check this first
+    enabled = False
+
+    # (kind, name) -> [calls, inclusive seconds, self seconds]
+    _stats = {}
+
+    # Open spans, each [key, start time, time spent in child spans]
+    _stack = []
+
+    # How many spans of each key are open, to not count recursion twice
+    _active = {}
+
+    @staticmethod
+    def reset():
+        CProfiler._stats = {}
+        CProfiler._stack = []
+        CProfiler._active = {}
+
+    @staticmethod
+    def begin(Kind, Name):
+        key = (Kind, Name)
+        CProfiler._active[key] = CProfiler._active.get(key, 0) + 1
+        CProfiler._stack.append([key, time.perf_counter(), 0.0])
+
+    @staticmethod
+    def end():
+        key, start, children = CProfiler._stack.pop()
+        elapsed = time.perf_counter() - start
+
+        stats = CProfiler._stats.get(key)
+
+        if stats is None:
+            stats = CProfiler._stats[key] = [0, 0.0, 0.0]
+
+        stats[0] += 1
+        stats[2] += elapsed - children
+
+        CProfiler._active[key] -= 1
+
+        if CProfiler._active[key] == 0:
+            # Outermost of any recursive calls covers the inner ones
+            stats[1] += elapsed
+
+        if CProfiler._stack:
+            CProfiler._stack[-1][2] += elapsed
+
+    @staticmethod
+    @contextlib.contextmanager
+    def span(Kind, Name):
+        if not CProfiler.enabled:
+            yield
+
+            return
+
+        CProfiler.begin(Kind, Name)
+
+        try:
+            yield
+        finally:
+            CProfiler.end()
+
+    @staticmethod
+    def take():
+        # Stats so far, starting over after
+        stats = CProfiler._stats
+        CProfiler._stats = {}
+
+        return stats
+
+    @staticmethod
+    def merge(Stats):
+        for key, (calls, inclusive, own) in Stats.items():
+            stats = CProfiler._stats.get(key)
+
+            if stats is None:
+                stats = CProfiler._stats[key] = [0, 0.0, 0.0]
+
+            stats[0] += calls
+            stats[1] += inclusive
+            stats[2] += own
+
+    @staticmethod
+    def _entries(Kinds, SortBy):
+        entries = [{'kind': kind,
+                    'name': name,
+                    'calls': calls,
+                    'inclusive': round(inclusive, 6),
+                    'self': round(own, 6)}
+                        for (kind, name), (calls, inclusive, own)
+                            in CProfiler._stats.items()
+                                if kind in Kinds]
+
+        entries.sort(key = lambda e: (-e[SortBy], e['kind'], e['name']))
+
+        return entries
+
+    @staticmethod
+    def report(Path, Top = 15):
+        # Page time is mostly spent in bindings, so sort pages by total
+        sections = [
+            ('phases', ['phase'], 'self'),
+            ('pages', ['page'], 'inclusive'),
+            ('bindings', ['macro', 'variable', 'function', 'unknown'], 'self'),
+        ]
+
+        report = {title: CProfiler._entries(kinds, sort_by)
+                    for title, kinds, sort_by in sections}
+
+        os.makedirs(os.path.dirname(Path), exist_ok = True)
+
+        with open(Path, 'w') as f:
+            json.dump(report, f, indent = 4)
+
+        lines = []
+
+        for title, _, sort_by in sections:
+            entries = report[title]
+            lines.append(f'{title.capitalize()} by {sort_by} time, '
+                         f'top {Top}:')
+            lines.append(f'    {"calls":>8} {"incl ms":>10} {"self ms":>10}  name')
+
+            for e in entries[: Top]:
+                lines.append(f'    {e["calls"]:>8} '
+                             f'{e["inclusive"] * 1000:>10.2f} '
+                             f'{e["self"] * 1000:>10.2f}  '
+                             f'{e["kind"]} {e["name"]}')
+
+        lines.append(f'Full profile in {Path}')
+
+        return lines
@@ -0,0 +1,414 @@
+"""
+    Copyright 2011 Alex Margarit
+    This file is part of Siter, a static website generator.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License version 3,
+    as published by the Free Software Foundation.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import collections, email.utils, functools, gzip, hashlib, http.server, os
+import subprocess, sys, threading
+
+from .util import *
+
+class CRequestHandler(http.server.SimpleHTTPRequestHandler):
+    # Keep connections open between requests
+    protocol_version = 'HTTP/1.1'
+
+    ReloadPath = '/__siter/reload'
+
+    # Inserted into HTML pages when live reload is on
+    ReloadScript = b"""
+<script>
+    new EventSource('/__siter/reload').onmessage = () => location.reload();
+</script>
+"""
+
+    # Types worth compressing when gzip is on
+    GzipTypes = ('text/', 'application/javascript', 'application/json',
+                 'application/xml', 'image/svg+xml')
+
+    # Larger files are sent as they are
+    GzipMaxSize = 8 * 1024 * 1024
+
+    def __init__(self, *Args, Server, **KwArgs):
+        self.siter_server = Server
+        super().__init__(*Args, **KwArgs)
+
+    def do_GET(self):
+        self._serve(True)
+
+    def do_HEAD(self):
+        self._serve(False)
+
+    def _serve(self, SendBody):
+        if self.path == CRequestHandler.ReloadPath \
+            and self.siter_server.live_reload:
+
+            self._send_reload_events()
+
+            return
+
+        path = self._find_file()
+
+        if path is None:
+            # Redirects, dir listings, and errors
+            if SendBody:
+                super().do_GET()
+            else:
+                super().do_HEAD()
+        elif self.siter_server.live_reload and path.endswith('.html'):
+            self._send_html(path, SendBody)
+        else:
+            self._send_file(path, SendBody)
+
+    def _find_file(self):
+        path = self.translate_path(self.path)
+
+        if os.path.isdir(path):
+            if not self.path.split('?', 1)[0].split('#', 1)[0].endswith('/'):
+                return None
+
+            for index in ('index.html', 'index.htm'):
+                index = os.path.join(path, index)
+
+                if os.path.isfile(index):
+                    return index
+
+            return None
+
+        if not os.path.isfile(path):
+            return None
+
+        return path
+
+    def _is_fresh(self, ETag, ModTime = None):
+        # If-None-Match wins over If-Modified-Since, like RFC 9110 says
+        tags = self.headers.get('If-None-Match')
+
+        if tags is not None:
+            tags = [t.strip().removeprefix('W/') for t in tags.split(',')]
+
+            return '*' in tags or ETag in tags
+
+        since = self.headers.get('If-Modified-Since')
+
+        if since is None or ModTime is None:
+            return False
+
+        try:
+            since = email.utils.parsedate_to_datetime(since).timestamp()
+        except (TypeError, ValueError, IndexError, OverflowError):
+            return False
+
+        return int(ModTime) <= since
+
+    def _get_range(self, Size, ETag, ModTime):
+        # Returns (start, end) for a single satisfiable range, None to send
+        # the whole file, or False if the range cannot be satisfied
+        value = self.headers.get('Range')
+
+        if value is None or not value.startswith('bytes='):
+            return None
+
+        condition = self.headers.get('If-Range')
+
+        if condition is not None \
+            and condition != ETag \
+            and condition != self.date_time_string(ModTime):
+
+            return None
+
+        spec = value[len('bytes='):].strip()
+
+        if ',' in spec or '-' not in spec:
+            # Multipart ranges are not worth it here, send everything
+            return None
+
+        first, last = spec.split('-', 1)
+
+        try:
+            if first == '':
+                length = int(last)
+
+                if length == 0:
+                    return False
+
+                start = max(Size - length, 0)
+                end = Size - 1
+            else:
+                start = int(first)
+                end = int(last) if last else Size - 1
+        except ValueError:
+            return None
+
+        if start >= Size:
+            return False
+
+        if start < 0 or end < start:
+            return None
+
+        return start, min(end, Size - 1)
+
+    def _wants_gzip(self, ContentType, Size):
+        if not self.siter_server.gzip or Size > CRequestHandler.GzipMaxSize:
+            return False
+
+        if not ContentType.startswith(CRequestHandler.GzipTypes):
+            return False
+
+        encodings = self.headers.get('Accept-Encoding', '')
+
+        return any(e.split(';')[0].strip() == 'gzip'
+                    for e in encodings.split(','))
+
+    def _send_not_modified(self, ETag, ModTime = None):
+        self.send_response(304)
+        self.send_header('ETag', ETag)
+
+        if ModTime is not None:
+            self.send_header('Last-Modified', self.date_time_string(ModTime))
+
+        self.end_headers()
+
+    def _send_file(self, Path, SendBody):
+        try:
+            f = open(Path, 'rb')
+        except OSError:
+            self.send_error(404, 'File not found')
+
+            return
+
+        with f:
+            info = os.fstat(f.fileno())
+            size = info.st_size
+            mod_time = info.st_mtime
+            etag = f'"{info.st_mtime_ns:x}-{size:x}"'
+            ctype = self.guess_type(Path)
+
+            if self._wants_gzip(ctype, size) \
+                and self.headers.get('Range') is None:
+
+                body = self.siter_server.get_gzip(Path, etag, f)
+                self._send_bytes(body, ctype, etag[: -1] + '-gz"', SendBody,
+                                 ModTime = mod_time,
+                                 Encoding = 'gzip')
+
+                return
+
+            if self._is_fresh(etag, mod_time):
+                self._send_not_modified(etag, mod_time)
+
+                return
+
+            span = self._get_range(size, etag, mod_time)
+
+            if span is False:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{size}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+                return
+
+            if span is None:
+                start, count = 0, size
+                self.send_response(200)
+            else:
+                start, count = span[0], span[1] - span[0] + 1
+                self.send_response(206)
+                self.send_header('Content-Range',
+                                 f'bytes {span[0]}-{span[1]}/{size}')
+
+            self.send_header('Content-Type', ctype)
+            self.send_header('Content-Length', str(count))
+            self.send_header('Last-Modified', self.date_time_string(mod_time))
+            self.send_header('ETag', etag)
+            self.send_header('Accept-Ranges', 'bytes')
+
+            if self.siter_server.gzip:
+                self.send_header('Vary', 'Accept-Encoding')
+
+            self.end_headers()
+
+            if SendBody and count > 0:
+                try:
+                    # Uses sendfile(2) where the platform has it
+                    self.connection.sendfile(f, start, count)
+                except (BrokenPipeError, ConnectionResetError):
+                    self.close_connection = True
+
+    def _send_bytes(self, Body, ContentType, ETag, SendBody, ModTime = None,
+                    Encoding = None, NoCache = False):
+
+        if self._is_fresh(ETag, ModTime):
+            self._send_not_modified(ETag, ModTime)
+
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', ContentType)
+        self.send_header('Content-Length', str(len(Body)))
+        self.send_header('ETag', ETag)
+
+        if ModTime is not None:
+            self.send_header('Last-Modified', self.date_time_string(ModTime))
+
+        if Encoding:
+            self.send_header('Content-Encoding', Encoding)
+
+        if self.siter_server.gzip:
+            self.send_header('Vary', 'Accept-Encoding')
+
+        if NoCache:
+            self.send_header('Cache-Control', 'no-cache')
+
+        self.end_headers()
+
+        if SendBody:
+            try:
+                self.wfile.write(Body)
+            except (BrokenPipeError, ConnectionResetError):
+                self.close_connection = True
+
+    def _send_html(self, Path, SendBody):
+        with open(Path, 'rb') as f:
+            body = f.read()
+
+        # Put the script at the end of the body if there is one
+        index = body.rfind(b'</body>')
+
+        if index < 0:
+            index = len(body)
+
+        body = body[: index] + CRequestHandler.ReloadScript + body[index :]
+        ctype = 'text/html; charset=utf-8'
+        encoding = None
+
+        if self._wants_gzip(ctype, len(body)):
+            body = gzip.compress(body, 6)
+            encoding = 'gzip'
+
+        etag = f'"{hashlib.sha1(body).hexdigest()}"'
+
+        self._send_bytes(body, ctype, etag, SendBody,
+                         Encoding = encoding,
+                         NoCache = True)
+
+    def _send_reload_events(self):
+        # The stream has no length, so it gets its own connection
+        self.close_connection = True
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+
+        try:
+            while self.siter_server.wait_for_build():
+                self.wfile.write(b'data: reload\n\n')
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+class CServer:
+    # Compressed bytes kept in memory, least recently served go first
+    GzipCacheSize = 64 * 1024 * 1024
+
+    def __init__(self, RootPath, LiveReload = False, Gzip = False):
+        self.live_reload = LiveReload
+        self.gzip = Gzip
+        self._gzip_cache = collections.OrderedDict()
+        self._gzip_size = 0
+        self._gzip_lock = threading.Lock()
+        self._build = 0
+        self._running = True
+        self._condition = threading.Condition()
+
+        handler = functools.partial(CRequestHandler,
+                                    Server = self,
+                                    directory = os.path.abspath(RootPath))
+
+        self._server = http.server.ThreadingHTTPServer(('localhost', 0),
+                                                       handler)
+        self._server.daemon_threads = True
+
+    def start(self):
+        host, port = self._server.server_address
+        url = f'http://{host}:{port}'
+
+        self._thread = threading.Thread(target = self._server.serve_forever)
+        self._thread.start()
+
+        CUtil.info(f'Web server running at {url}')
+
+        cmd = f'xdg-open {url}'
+        status, output = subprocess.getstatusoutput(cmd)
+
+        for line in output.splitlines():
+            CUtil.message('Browser', line)
+
+        if status != 0:
+            self.stop()
+            sys.exit(status)
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def notify_build(self):
+        with self._condition:
+            self._build += 1
+            self._condition.notify_all()
+
+    def wait_for_build(self):
+        # Returns True after a new build, or False when shutting down
+        with self._condition:
+            build = self._build
+
+            self._condition.wait_for(
+                lambda: self._build != build or not self._running)
+
+            return self._running
+
+    def get_gzip(self, Path, ETag, File):
+        # One entry per path, made again when the file's ETag changes
+        with self._gzip_lock:
+            entry = self._gzip_cache.get(Path)
+
+            if entry and entry[0] == ETag:
+                self._gzip_cache.move_to_end(Path)
+
+                return entry[1]
+
+        body = gzip.compress(File.read(), 6)
+
+        with self._gzip_lock:
+            entry = self._gzip_cache.pop(Path, None)
+
+            if entry:
+                self._gzip_size -= len(entry[1])
+
+            self._gzip_cache[Path] = (ETag, body)
+            self._gzip_size += len(body)
+
+            while self._gzip_size > CServer.GzipCacheSize:
+                _, (_, old_body) = self._gzip_cache.popitem(last = False)
+                self._gzip_size -= len(old_body)
+
+        return body
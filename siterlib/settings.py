@@ -26,6 +26,9 @@ class CSettings:
     DirTemplate = 'siter-template'
     TemplatePage = 'page.html'
 
+    # Persistent caches, safe to delete
+    DirCache = '.siter-cache'
+
     # Blocks that start with this are evaluated; must be exactly 1 char
     EvalHint = '!'
 
@@ -49,6 +52,12 @@ class CSettings:
     Markdown = 'siter-md'
     Anchor = 'siter-anchor'
     Foreach = 'siter-foreach'
+    Asset = 'siter-asset'
+    Paginate = 'siter-paginate'
+    PageNumber = 'siter-page-number'
+    PageCount = 'siter-page-count'
+    PagePrev = 'siter-page-prev'
+    PageNext = 'siter-page-next'
 
     # HTML container class for highlighted code
     PygmentsDiv = 'siter_code'
@@ -15,38 +15,82 @@
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-import time
+import collections, concurrent.futures, os, shutil, sys, tempfile, time
 
-import markdown
+import markdown, pygments
 from markdown.extensions.codehilite import CodeHiliteExtension
 from markdown.extensions.fenced_code import FencedCodeExtension
 from markdown.extensions.toc import TocExtension
 
+from .assets import *
+from .bench import *
 from .binding import *
+from .cache import *
+from .depends import *
 from .file import *
 from .functions import *
+from .memo import *
+from .minify import *
+from .profile import *
+from .server import *
 from .settings import *
+from .sync import *
 from .token import *
 from .tokenizer import *
 from .util import *
 
 class CSiter:
+    # Command line options and their defaults; non-bool options take a value
+    _options = {
+        'tokenizer': CTokenizer.Engine,
+        'no-cache': False,
+        'incremental': False,
+        'jobs': 1,
+        'memoize': 0,
+        'no-md-cache': False,
+        'md-cache-size': 256,
+        'stub-cache-size': 64,
+        'static-copy': 'copy',
+        'static-hash': False,
+        'static-fingerprint': False,
+        'gzip-level': 0,
+        'minify': False,
+        'watch': False,
+        'watch-interval': 1.0,
+        'serve-gzip': False,
+        'profile': False,
+        'bench-runs': 3,
+        'bench-warm': False,
+        'bench-save': '',
+        'bench-baseline': '',
+        'bench-tolerance': 0.1,
+        **{f'bench-{name}': value for name, value in CBench.Params.items()},
+    }
+
     def __init__(self, Argv):
+        args = self._parse_args(Argv)
+
         try:
-            command = Argv[1]
+            command = args[0]
         except IndexError:
             command = ''
 
         try:
-            path_arg = Argv[2]
+            path_arg = args[1]
         except IndexError:
             path_arg = '.'
 
+        CTokenizer.set_engine(self.options['tokenizer'])
+        self._set_profiling()
+
         if command == 'new':
             CDirs.new_project(path_arg)
+        elif command == 'bench':
+            self._step_bench(args[1] if len(args) > 1 else None)
         else:
             do_gen = False
             do_serve = False
+            do_watch = self.options['watch']
 
             if command == 'gen':
                 do_gen = True
@@ -55,6 +99,14 @@ class CSiter:
                 do_serve = True
             elif command == 'serve':
                 do_serve = True
+
+                # Serving as is never builds, so there would be nothing to redo
+                if do_watch:
+                    CUtil.error('siter serve does not take --watch, ' \
+                                'use siter run --watch')
+            elif command == 'watch':
+                do_gen = True
+                do_watch = True
             elif command == '':
                 do_gen = True
             else:
@@ -69,64 +121,509 @@ class CSiter:
             if do_gen:
                 self._log('Total Gen', self._step_main)
 
-            if do_serve:
+            if do_watch and do_gen:
+                for line in self._log_out:
+                    CUtil.info(line)
+
+                self._step_watch(do_serve)
+            elif do_serve:
                 self._log('Total Serve', self._step_serve)
 
             for line in self._log_out:
                 CUtil.info(line)
 
+    def _parse_args(self, Argv):
+        args = []
+        argv = iter(Argv[1 :])
+        self.options = dict(CSiter._options)
+
+        for arg in argv:
+            if not arg.startswith('--'):
+                args.append(arg)
+
+                continue
+
+            # `--name`, `--name=value`, or `--name value`
+            name, has_value, value = arg[2 :].partition('=')
+
+            if name not in self.options:
+                CUtil.error(f'Unknown option {arg}')
+
+            default = self.options[name]
+
+            if type(default) is bool:
+                if has_value:
+                    CUtil.error(f'Option --{name} does not take a value')
+
+                value = True
+            else:
+                if not has_value:
+                    value = next(argv, None)
+
+                    if value is None:
+                        CUtil.error(f'Option --{name} needs a value')
+
+                try:
+                    value = type(default)(value)
+                except ValueError:
+                    CUtil.error(f'Invalid value for --{name}: {value}')
+
+            self.options[name] = value
+
+        return args
+
     def _log(self, Tag, Function):
         self._log_out.append(f'{Tag}: {CUtil.time_step(Function)}s')
 
+    def _set_profiling(self):
+        CProfiler.enabled = self.options['profile']
+
+        if CProfiler.enabled:
+            # Only pay for timing calls when profiling
+            self.evaluate_call = self._profile_call
+
+    def _make_markdown(self):
+        output_format = 'html5'
+        extensions = [
+            CodeHiliteExtension(css_class = CSettings.PygmentsDiv,
+                                linenums = True),
+            FencedCodeExtension(),
+            TocExtension(title = CSettings.TocTitle,
+                         permalink = CSettings.HeaderLink),
+        ]
+
+        self.md = markdown.Markdown(output_format = output_format,
+                                    extensions = extensions)
+
+        # Cached output is only valid for the same setup
+        md_config = [markdown.__version__, pygments.__version__, output_format]
+
+        for e in extensions:
+            md_config.append((type(e).__name__,
+                              sorted([(k, getattr(v, '__qualname__', v))
+                                        for k, v in e.getConfigs().items()])))
+
+        self.md_config = CCache.digest(repr(md_config))
+        self.md_cache = CCache('markdown',
+                               1,
+                               not self.options['no-cache']
+                                and not self.options['no-md-cache'],
+                               Lru = True)
+
     def _step_main(self):
-        self.md = markdown.Markdown(
-                    output_format = 'html5',
-                    extensions = [
-                        CodeHiliteExtension(css_class = CSettings.PygmentsDiv,
-                                            linenums = True),
-                        FencedCodeExtension(),
-                        TocExtension(title = CSettings.TocTitle,
-                                     permalink = CSettings.HeaderLink),
-                    ])
-
-        self._log('Load pages', self._step_load)
+        self._make_markdown()
+        self._build(Warm = False)
+
+    def _build(self, Warm):
+        CProfiler.reset()
+
+        self._log('Load pages', lambda: self._step_load(Warm = Warm))
+
         self._log('Copy static', self._step_static)
+        self._log_out.append(f'Static files: {self.sync.unchanged} unchanged, '
+                             f'{self.sync.copied} copied')
         self._log('Generate pages', self._step_gen)
+
+        if self.assets.gzip_level > 0:
+            self._log('Compress output', self._step_compress)
+            self._log_out.append(f'Compressed files: {self.assets.reused} '
+                                 f'unchanged, {self.assets.compressed} '
+                                 f'compressed')
+
         self._log('Copy output', self._step_copy)
 
+        for name, value in sorted(self._get_counters().items()):
+            self._log_out.append(f'{name}: {value}')
+
+        if CProfiler.enabled:
+            self._log_out += CProfiler.report(
+                                os.path.join(CSettings.DirCache, 'profile.json'))
+
+    def _step_bench(self, Path):
+        params = {name: self.options[f'bench-{name}'] for name in CBench.Params}
+        options = {name: value for name, value in self.options.items()
+                    if not name.startswith('bench-')}
+
+        # Paths are relative to where siter was started
+        save_path = self.options['bench-save']
+        save_path = save_path and os.path.abspath(save_path)
+        baseline_path = self.options['bench-baseline']
+        baseline = baseline_path and CBench.load(baseline_path)
+
+        work_dir = os.getcwd()
+        temp_dir = None
+
+        if Path is None:
+            temp_dir = tempfile.mkdtemp(prefix = 'siter-bench-')
+            Path = os.path.join(temp_dir, 'site')
+
+        warm = self.options['bench-warm']
+        runs = {phase: [] for phase in CBench.Phases}
+
+        try:
+            CUtil.capture_begin()
+            CBench.make_project(Path, params)
+            CUtil.capture_end()
+
+            # Warm runs start from the caches and output of a first build
+            for run in range(self.options['bench-runs'] + warm):
+                if not warm:
+                    shutil.rmtree(CSettings.DirCache, ignore_errors = True)
+                    shutil.rmtree(CSettings.DirOut, ignore_errors = True)
+
+                # Also opens the Markdown cache, which is gone on cold runs
+                self._make_markdown()
+
+                CUtil.capture_begin()
+
+                times = {
+                    'tokenize': CBench.time_step(CBench.tokenize),
+                    'load': CBench.time_step(self._step_load),
+                    'static': CBench.time_step(self._step_static),
+                    'generate': CBench.time_step(self._step_gen),
+                    'copy': CBench.time_step(self._step_copy),
+                }
+
+                CUtil.capture_end()
+
+                if warm and run == 0:
+                    continue
+
+                for phase, seconds in times.items():
+                    runs[phase].append(seconds)
+
+            memory = CBench.measure_memory()
+        finally:
+            os.chdir(work_dir)
+
+            if temp_dir:
+                shutil.rmtree(temp_dir)
+
+        report = CBench.report(params, options, runs, memory)
+
+        for phase, seconds in report['results'].items():
+            CUtil.info(f'Bench {phase}: {seconds}s')
+
+        for name, size in memory.items():
+            CUtil.info(f'Bench {name}: {size / (1024 * 1024):.2f}MB')
+
+        if save_path:
+            CBench.save(save_path, report)
+            CUtil.info(f'Saved results to {save_path}')
+
+        if baseline:
+            lines, regressions = CBench.compare(
+                                    report,
+                                    baseline,
+                                    self.options['bench-tolerance'])
+
+            for line in lines:
+                CUtil.info(line)
+
+            if regressions:
+                CUtil.warning(f'Worse than {baseline_path} by more than '
+                              f'{self.options["bench-tolerance"]:.0%}: '
+                              f'{", ".join(regressions)}')
+                sys.exit(1)
+
     def _step_serve(self):
-        CUtil.run_server(CSettings.DirOut)
+        server = CServer(CSettings.DirOut, Gzip = self.options['serve-gzip'])
+        server.start()
+
+        input('\nPress ENTER to exit web server\n\n')
+
+        server.stop()
+
+    def _step_watch(self, Serve):
+        server = None
+
+        if Serve:
+            server = CServer(CSettings.DirOut,
+                             LiveReload = True,
+                             Gzip = self.options['serve-gzip'])
+            server.start()
 
-    def _step_load(self):
-        self.dirs = CDirs()
-        self.bindings = CBindingCollection(self)
+        # Rebuilds only generate pages whose dependencies changed
+        self.options['incremental'] = True
+        snapshot = CDirs.snapshot()
+
+        CUtil.info('Watching for changes, press Ctrl-C to stop')
+
+        try:
+            while True:
+                time.sleep(self.options['watch-interval'])
+                current = CDirs.snapshot()
+
+                if current == snapshot:
+                    continue
+
+                snapshot = current
+
+                if self._rebuild() and server:
+                    server.notify_build()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._log_out = []
+
+            if server:
+                server.stop()
+
+    def _rebuild(self):
+        self._log_out = []
+
+        try:
+            self._log('Total Rebuild', lambda: self._build(Warm = True))
+        except SystemExit:
+            # Likely a half-saved file, wait for the next change
+            CUtil.warning('Build failed, kept the previous ' \
+                          f'{CSettings.DirOut}')
+
+            # The failed build may have left bindings half-made, and
+            # records of pages that never made it to siter-out
+            self._config_files = None
+            self.graph.rollback()
+
+            return False
+
+        for line in self._log_out:
+            CUtil.info(line)
+
+        return True
+
+    def _step_load(self, Setup = True, Warm = False):
+        # The check engine must see the files, not what was cached
+        self.token_cache = CCache('tokens',
+                                  CTokenizer.Version,
+                                  not self.options['no-cache']
+                                    and CTokenizer.Engine != 'check')
+
+        # Warm rebuilds keep the files that did not change since last time
+        self.dirs = CDirs(self.token_cache, Setup, self.dirs if Warm else None)
+
+        if Warm:
+            self.graph.advance()
+        else:
+            self.graph = CDependencyGraph(not self.options['no-cache'],
+                                          (self.options['minify'],
+                                           self.md_config))
+
+        self.counters = collections.Counter()
+        self._worker_counters = collections.Counter()
+        self.md_cache.hits = 0
+        self.md_cache.misses = 0
         self._stubs_cache = {}
+        self.constants = {}
+        self.stub_cache = CCache('stubs',
+                                 1,
+                                 not self.options['no-cache'],
+                                 Lru = True)
 
-        self._set_global_bindings()
+        # Expansions can depend on siter-foreach files, which may have changed
+        self.memo = CMemo(self.options['memoize'])
 
-        for f in self.dirs.get(CSettings.DirConfig).get_files():
-            self._set_file_bindings(f, False)
+        config_files = list(self.dirs.get(CSettings.DirConfig).get_files())
+        generated = time.strftime('%Y-%m-%d')
+
+        # Warm rebuilds keep the global bindings when the config is the same
+        if not Warm \
+            or config_files != self._config_files \
+            or generated != self._generated:
+
+            self._config_files = config_files
+            self._generated = generated
+
+            self.bindings = CBindingCollection(self)
+
+            self._set_global_bindings(generated)
+            self._set_config_bindings(config_files, generated)
+
+        self._set_asset_bindings()
 
     def _step_static(self):
-        self.dirs.get(CSettings.DirStatic).copy_to(
-            self.dirs.get(CSettings.DirStaging))
+        self.sync = CSync(self.options['static-copy'],
+                          self.options['static-hash'],
+                          CCache('digests', 1, not self.options['no-cache']),
+                          self.options['minify'],
+                          self.options['jobs'] or os.cpu_count())
+
+        self.sync.sync(self.dirs.get(CSettings.DirStatic),
+                       self.dirs.get(CSettings.DirOut),
+                       self.dirs.get(CSettings.DirStaging))
+
+        self.assets.link(self.dirs.get(CSettings.DirStaging))
+
+        if self.options['minify']:
+            self.counters['Minified bytes saved'] += self.sync.saved
+
+    def _step_compress(self):
+        self.assets.compress(self.dirs.get(CSettings.DirStaging),
+                             self.dirs.get(CSettings.DirOut),
+                             self.options['jobs'] or os.cpu_count())
 
     def _step_gen(self):
+        out_dir = self.dirs.get(CSettings.DirOut)
+        pages_dir = self.dirs.get(CSettings.DirPages)
+        staging_dir = self.dirs.get(CSettings.DirStaging)
+
+        in_files = []
+
+        for in_file in pages_dir.get_files():
+            if self.options['incremental'] \
+                and self.graph.is_fresh(self, in_file) \
+                and in_file.carry(out_dir,
+                                  staging_dir,
+                                  pages_dir,
+                                  self.graph.outputs(in_file)):
+
+                self.counters['Pages skipped'] += 1
+
+                continue
+
+            in_files.append(in_file)
+
+        jobs = self.options['jobs'] or os.cpu_count()
+
+        if jobs > 1 and len(in_files) > 1:
+            with concurrent.futures.ProcessPoolExecutor(
+                    max_workers = min(jobs, len(in_files)),
+                    initializer = CSiter._worker_init,
+                    initargs = (self.options,)) as pool:
+
+                # Results come back in page order, like the serial path
+                results = pool.map(CSiter._worker_gen,
+                                   [f.shortpath for f in in_files])
+
+                for in_file, (lines, record, counters, profile) \
+                    in zip(in_files, results):
+
+                    CUtil.replay(lines)
+                    self.graph.set(in_file, record)
+                    self._worker_counters.update(counters)
+                    CProfiler.merge(profile)
+        else:
+            for in_file in in_files:
+                self.graph.set(in_file, self._gen_page(in_file))
+
+    def _get_counters(self):
+        counters = collections.Counter(self.counters)
+
+        if self.memo.size > 0:
+            counters['Macro memo hits'] = self.memo.hits
+            counters['Macro memo misses'] = self.memo.misses
+
+        # Files load when first used, so these add up while generating
+        if self.token_cache.enabled:
+            counters['Token cache hits'] = self.token_cache.hits
+            counters['Token cache misses'] = self.token_cache.misses
+
+        if self.md_cache.enabled:
+            counters['Markdown cache hits'] = self.md_cache.hits
+            counters['Markdown cache misses'] = self.md_cache.misses
+
+        counters.update(self._worker_counters)
+
+        return counters
+
+    def _gen_page(self, InFile):
         page_template = self.dirs.get(CSettings.DirTemplate).get_file(
                             CSettings.TemplatePage)
 
-        for in_file in self.dirs.get(CSettings.DirPages).get_files():
-            in_file.write(self.process_file(in_file, page_template),
-                          self.dirs.get(CSettings.DirStaging),
-                          self.dirs.get(CSettings.DirPages))
+        record = None
+        number = 1
+        minify = CMinify.html if self.options['minify'] else None
+
+        # siter-paginate raises this while making the first page
+        self.page_count = 1
+
+        with CProfiler.span('page', InFile.shortpath):
+            while number <= self.page_count:
+                writer = InFile.open_writer(self.dirs.get(CSettings.DirStaging),
+                                            self.dirs.get(CSettings.DirPages),
+                                            self.dirs.get(CSettings.DirOut),
+                                            number,
+                                            minify)
+
+                self.bindings.record_begin()
+
+                # The page goes out in pieces as the template is evaluated
+                with CProfiler.span('phase', 'evaluate'):
+                    self.process_file(InFile,
+                                      page_template,
+                                      Write = writer.write,
+                                      PageNumber = number)
+
+                if record is None:
+                    record = self.bindings.record_end()
+                else:
+                    record.merge(self.bindings.record_end())
+
+                with CProfiler.span('phase', 'write'):
+                    written = writer.close()
+
+                if minify:
+                    self.counters['Minified bytes saved'] += writer.saved
+
+                if written:
+                    self.counters['Pages written'] += 1
+                else:
+                    self.counters['Pages unchanged'] += 1
+
+                number += 1
+
+        record.outputs = self.page_count
+
+        return record
+
+    # The instance owned by this worker process
+    _worker = None
+
+    @staticmethod
+    def _worker_init(Options):
+        # Seed the worker with its own copy of the evaluated siter-config
+        siter = CSiter.__new__(CSiter)
+        siter.options = Options
+
+        CTokenizer.set_engine(Options['tokenizer'])
+        siter._set_profiling()
+        CUtil.capture_begin()
+
+        siter._make_markdown()
+        siter._step_load(Setup = False)
+
+        CUtil.capture_end()
+        CSiter._worker = siter
+
+    @staticmethod
+    def _worker_gen(ShortPath):
+        siter = CSiter._worker
+        in_file = siter.dirs.find_file(ShortPath)
+
+        counters = siter._get_counters()
+        CProfiler.take()
+
+        CUtil.capture_begin()
+        record = siter._gen_page(in_file)
+
+        # Only report what this page added
+        counters = siter._get_counters() - counters
+
+        return CUtil.capture_end(), record, counters, CProfiler.take()
 
     def _step_copy(self):
         self.dirs.get(CSettings.DirStaging).replace(
             self.dirs.get(CSettings.DirOut))
 
-    def _set_global_bindings(self):
+        # Only remember dependencies for output that made it out
+        self.graph.save()
+
+        self.md_cache.trim(self.options['md-cache-size'] * 1024 * 1024)
+        self.stub_cache.trim(self.options['stub-cache-size'] * 1024 * 1024)
+        self.assets.evict()
+
+    def _set_global_bindings(self, Generated):
         self.bindings.add_variable(CSettings.Generated,
-                                   CTokenizer.text(time.strftime('%Y-%m-%d')))
+                                   CTokenizer.text(Generated))
 
         self.bindings.add_function(CSettings.Def,
                                    [1, 2, 3],
@@ -138,51 +635,126 @@ class CSiter:
                                    [2, 3],
                                    CFunctions.if_check,
                                    Protected = True,
-                                   Lazy = True)
+                                   Lazy = True,
+                                   Pure = True)
 
         self.bindings.add_function(CSettings.Datefmt,
                                    [2],
                                    CFunctions.datefmt,
-                                   Protected = True)
+                                   Protected = True,
+                                   Pure = True)
 
         self.bindings.add_function(CSettings.Markdown,
                                    [1],
                                    CFunctions.markdown,
-                                   Protected = True)
+                                   Protected = True,
+                                   Pure = True)
 
         self.bindings.add_function(CSettings.Anchor,
                                    [1],
                                    CFunctions.anchor,
-                                   Protected = True)
+                                   Protected = True,
+                                   Pure = True)
 
         self.bindings.add_function(CSettings.Foreach,
                                    [2, 3],
                                    CFunctions.foreach,
+                                   Protected = True,
+                                   Pure = True)
+
+        self.bindings.add_function(CSettings.Asset,
+                                   [1],
+                                   CFunctions.asset,
+                                   Protected = True,
+                                   Pure = True)
+
+        self.bindings.add_function(CSettings.Paginate,
+                                   [2, 3],
+                                   CFunctions.paginate,
                                    Protected = True)
 
-    def _set_local_bindings(self, ReadFile, IsStub):
-        f_time = ReadFile.get_mod_time()
-        time_obj = time.localtime(f_time)
+    def _set_config_bindings(self, ConfigFiles, Generated):
+        cache = CCache('config',
+                       CTokenizer.Version,
+                       not self.options['no-cache'])
+
+        # The same config files on the same day make the same definitions
+        key = (Generated,
+               tuple((f.shortpath, f.fingerprint()) for f in ConfigFiles))
+
+        # Files or dirs read by functions in the config must be unchanged
+        snapshot = cache.get(key, lambda s: s[0].is_fresh(self))
+
+        if snapshot:
+            CUtil.message('Snapshot', f'Bindings from {CSettings.DirConfig}')
+            self.bindings.add_globals(snapshot[1])
+
+            return
+
+        before = self.bindings.get_globals()
+        self.bindings.record_begin()
+
+        for f in ConfigFiles:
+            self._set_file_bindings(f, False)
+
+        record = self.bindings.record_end()
+        record.bindings = {}
+
+        # Only what the config files added or replaced
+        cache.set(key,
+                  (record,
+                   {name: binding
+                        for name, binding in self.bindings.get_globals().items()
+                        if before.get(name) is not binding}))
+
+        # Older snapshots can not match again
+        cache.evict([key])
+
+    def _set_asset_bindings(self):
+        previous = getattr(self, 'assets', None)
+
+        self.assets = CAssets(self.options['static-fingerprint'],
+                              self.options['gzip-level'],
+                              CCache('assets', 1, not self.options['no-cache']))
 
+        self.assets.scan(self.dirs.get(CSettings.DirStatic))
+
+        # Warm rebuilds drop the files that went away since last time
+        if previous:
+            for url in previous.urls:
+                if url not in self.assets.urls:
+                    self.bindings.remove(CAssets.binding(url))
+
+        for url, hashed_url in self.assets.urls.items():
+            self.bindings.add_variable(CAssets.binding(url),
+                                       CTokenizer.text(hashed_url))
+
+    def _set_local_bindings(self, ReadFile, IsStub, PageNumber):
         self.bindings.add_variable(CSettings.Modified,
-                                   CTokenizer.text(time.strftime('%Y-%m-%d',
-                                                                 time_obj)))
+                                   CTokenizer.text(ReadFile.get_mod_date()))
 
         if not IsStub:
-            # Stubs inherit the caller page's path to root
+            # Stubs inherit the caller page's path to root and page number
             rel_root = ReadFile.path_to(self.dirs.get(CSettings.DirPages))
 
             self.bindings.add_variable(CSettings.Root,
                                        CTokenizer.text(rel_root))
 
+            self.bindings.add_variable(CSettings.PageNumber,
+                                       CTokenizer.text(str(PageNumber)))
+
         self.bindings.add_variable(CSettings.Name,
                                    CTokenizer.text(ReadFile.name_noext))
 
         self.bindings.add_variable(CSettings.Path,
                                    CTokenizer.text(ReadFile.path_public))
 
-    def _set_file_bindings(self, ReadFile, SetContent):
-        content_tokens = self._evaluate_collection(ReadFile.tokens)
+    def _set_file_bindings(self, ReadFile, SetContent, IsStub = False):
+        if IsStub:
+            # Stubs can be listed by many pages, worth compiling
+            content_tokens = ReadFile.compiled()(self)
+        else:
+            content_tokens = self._evaluate_collection(ReadFile.get_tokens())
 
         if SetContent:
             self.bindings.add_variable(CSettings.Content,
@@ -201,8 +773,6 @@ class CSiter:
         return eval_tokens
 
     def evaluate_block(self, Block):
-        eval_tokens = CTokenCollection()
-
         # Get the binding's name
         name = Block.capture_call()
 
@@ -210,16 +780,75 @@ class CSiter:
             # This Block does not call a binding
             return self._evaluate_collection(Block.tokens)
 
-        if not self.bindings.contains(name):
+        return self.evaluate_call(name, Block)
+
+    def _is_pure(self, Record):
+        # Reusing what a function with side effects made would skip those
+        for name in Record.bindings:
+            binding = self.bindings.peek(name)
+
+            if type(binding) is CBindingFunction and not binding.pure:
+                return False
+
+        return True
+
+    def _is_constant(self, Record):
+        # Only global bindings that are still visible and unchanged
+        for name, (index, fingerprint) in Record.bindings.items():
+            binding = self.bindings.peek(name)
+
+            if index != 0 \
+                or binding is None \
+                or binding is not self.bindings.frames[0].get(name) \
+                or binding.fingerprint() != fingerprint:
+
+                return False
+
+        return self._is_pure(Record)
+
+    def _evaluate_global(self, Binding):
+        entry = self.constants.get(Binding)
+
+        if entry and self._is_constant(entry[0]):
+            record, tokens = entry
+            self.counters['Constant variables reused'] += 1
+
+            if self.bindings.records:
+                self.bindings.records[-1].merge(record)
+
+            return CTokenCollection(list(tokens))
+
+        if entry is False:
+            return Binding.compiled()(self)
+
+        self.bindings.record_begin()
+        eval_binding = Binding.compiled()(self)
+        record = self.bindings.record_end()
+
+        if self._is_constant(record):
+            # Same result anywhere in this build, evaluate it only once
+            self.constants[Binding] = (record, list(eval_binding.tokens))
+        else:
+            self.constants[Binding] = False
+
+        return eval_binding
+
+    def evaluate_call(self, Name, Block):
+        eval_tokens = CTokenCollection()
+        binding = self.bindings.find(Name)
+
+        if binding is None:
             # Name is unknown, discard Block
-            CUtil.warning(f'Use of unknown binding {name}:\n{Block}')
+            CUtil.warning(f'Use of unknown binding {Name}:\n{Block}')
 
             return eval_tokens
 
-        binding = self.bindings.get(name)
-
         if type(binding) is CBindingVariable:
-            eval_binding = self._evaluate_collection(binding.tokens)
+            if binding is self.bindings.frames[0].get(Name):
+                eval_binding = self._evaluate_global(binding)
+            else:
+                eval_binding = binding.compiled()(self)
+
             eval_tokens.add_collection(eval_binding)
         elif type(binding) is CBindingMacro:
             args = Block.capture_args(binding.num_params == 1)
@@ -228,7 +857,7 @@ class CSiter:
                 len(args) > binding.num_params:
 
                 CUtil.warning(
-                    f'Macro {name} takes ' \
+                    f'Macro {Name} takes ' \
                     f'{binding.num_params_req}-{binding.num_params} ' \
                     f'args, got {len(args)}:\n{Block}')
 
@@ -237,15 +866,44 @@ class CSiter:
             self.bindings.push()
 
             # Bind each parameter to the supplied argument
+            arg_keys = []
+
             for param, arg in zip(binding.params, args):
-                self.bindings.add_variable(param, self.evaluate_block(arg))
+                eval_arg = self.evaluate_block(arg)
+                self.bindings.add_variable(param, eval_arg)
+
+                if self.memo.size > 0:
+                    arg_keys.append(CMemo.arg_key(eval_arg))
 
             # Fill in missing optional arguments
             for param in binding.params[len(args) :]:
                 self.bindings.add_variable(param, CTokenCollection())
 
-            # Evaluate macro body's tokens with the set parameters
-            eval_binding = self._evaluate_collection(binding.tokens)
+            # Arguments that define other bindings make the expansion unique
+            memo_key = None
+
+            if self.memo.size > 0 \
+                and len(self.bindings.frames[-1]) == binding.num_params:
+
+                memo_key = (binding, tuple(arg_keys))
+                eval_binding = self.memo.get(self, memo_key)
+            else:
+                eval_binding = None
+
+            if eval_binding is None:
+                if memo_key:
+                    # Bindings from outside the macro's own frame
+                    self.bindings.record_begin(len(self.bindings.frames) - 1)
+
+                # Evaluate macro body's tokens with the set parameters
+                eval_binding = binding.compiled()(self)
+
+                if memo_key:
+                    record = self.bindings.record_end()
+
+                    if self._is_pure(record):
+                        self.memo.set(memo_key, record, eval_binding)
+
             eval_tokens.add_collection(eval_binding)
 
             self.bindings.pop()
@@ -253,7 +911,7 @@ class CSiter:
             args = Block.capture_args(binding.num_params == [1])
 
             if len(args) not in binding.num_params:
-                CUtil.warning(f'Function {name} takes ' \
+                CUtil.warning(f'Function {Name} takes ' \
                               f'{binding.num_params} args, ' \
                               f'got {len(args)}:\n{Block}')
 
@@ -268,30 +926,105 @@ class CSiter:
                 arguments = [self.evaluate_block(a).resolve() for a in args]
 
                 body = binding.func(self, arguments)
-                eval_tokens.add_token(CTokenText(body))
+
+                if type(body) is list:
+                    # Pieces of text, kept apart to not join big results
+                    for text in body:
+                        eval_tokens.add_token(CTokenText(text))
+                else:
+                    eval_tokens.add_token(CTokenText(body))
 
         # Trim leading and trailing whitespace
         eval_tokens.trim()
 
         return eval_tokens
 
-    def process_file(self, InFile, TemplateFile, IsStub = False):
+    def _profile_call(self, Name, Block):
+        binding = self.bindings.peek(Name)
+
+        if type(binding) is CBindingVariable:
+            kind = 'variable'
+        elif type(binding) is CBindingMacro:
+            kind = 'macro'
+        elif type(binding) is CBindingFunction:
+            kind = 'function'
+        else:
+            kind = 'unknown'
+
+        CProfiler.begin(kind, Name)
+
+        try:
+            return CSiter.evaluate_call(self, Name, Block)
+        finally:
+            CProfiler.end()
+
+    def record_file(self, File):
+        if self.bindings.records:
+            self.bindings.records[-1].files[File.shortpath] = File.fingerprint()
+
+    def record_dir(self, ShortPath):
+        if self.bindings.records:
+            self.bindings.records[-1].dirs[ShortPath] = \
+                self.dirs.find_dir_names(ShortPath)
+
+    def _find_stub(self, Key):
+        # Rendered earlier in this build, or in a previous one
+        entry = self._stubs_cache.get(Key) or self.stub_cache.get(Key)
+
+        if entry is None or not entry[1].is_fresh(self, Scoped = True):
+            self.counters['Stubs rendered'] += 1
+
+            return None
+
+        self._stubs_cache[Key] = entry
+        self.counters['Stubs reused'] += 1
+
+        return entry
+
+    def process_file(self, InFile, TemplateFile, IsStub = False, Write = None,
+                     PageNumber = 1):
         CUtil.message('Process', InFile.shortpath)
 
-        if IsStub and InFile.shortpath in self._stubs_cache:
-            return self._stubs_cache[InFile.shortpath]
+        if IsStub:
+            # Stubs inherit the caller page's path to root
+            root = self.bindings.get(CSettings.Root).tokens.resolve()
+            stub_key = (InFile.shortpath,
+                        TemplateFile.shortpath,
+                        root,
+                        self.md_config)
+
+            entry = self._find_stub(stub_key)
+
+            if entry:
+                final, record = entry
+
+                if self.bindings.records:
+                    self.bindings.records[-1].merge(record)
+
+                return final
+
+        self.bindings.record_begin()
+        self.record_file(InFile)
+        self.record_file(TemplateFile)
 
         self.bindings.push()
 
-        self._set_local_bindings(InFile, IsStub)
-        self._set_file_bindings(InFile, True)
+        self._set_local_bindings(InFile, IsStub, PageNumber)
+        self._set_file_bindings(InFile, True, IsStub)
 
         # Load template and replace variables and functions with bindings
-        final = self._evaluate_collection(TemplateFile.tokens).resolve()
+        if Write:
+            TemplateFile.compiled()(self, Write)
+            final = None
+        else:
+            final = TemplateFile.compiled()(self).resolve()
 
         self.bindings.pop()
 
+        record = self.bindings.record_end()
+
         if IsStub:
-            self._stubs_cache[InFile.shortpath] = final
+            self._stubs_cache[stub_key] = (final, record)
+            self.stub_cache.set(stub_key, (final, record))
 
         return final
@@ -0,0 +1,209 @@
+"""
+    Copyright 2011 Alex Margarit
+    This file is part of Siter, a static website generator.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License version 3,
+    as published by the Free Software Foundation.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import concurrent.futures, hashlib, os, shutil
+
+from .cache import *
+from .minify import *
+from .util import *
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+class CSync:
+    # How to bring new or changed files over
+    Methods = ['copy', 'hardlink', 'reflink']
+
+    # Linux ioctl to share a file's blocks on copy-on-write file systems
+    _ficlone = 0x40049409
+
+    def __init__(self, Method, UseHash, DigestCache, Minify = False, Jobs = 1):
+        if Method not in CSync.Methods:
+            CUtil.error(f'Unknown copy method {Method}, ' \
+                        f'use one of {", ".join(CSync.Methods)}')
+
+        self.method = Method
+        self.use_hash = UseHash
+        self.digests = CDigests(DigestCache)
+        self.minify = Minify
+        self.jobs = Jobs
+        self.unchanged = 0
+        self.copied = 0
+        self.saved = 0
+
+    def _digest(self, Path, Stat):
+        key = (os.path.abspath(Path), Stat.st_size, Stat.st_mtime_ns)
+
+        return self.digests.digest(key, Path)
+
+    @staticmethod
+    def hash_file(Path):
+        h = hashlib.sha1()
+
+        with open(Path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                h.update(chunk)
+
+        return h.hexdigest()
+
+    @staticmethod
+    def _minified_key(Stat):
+        # Renaming siter-staging to siter-out keeps the inode
+        return ('minified',
+                Stat.st_dev, Stat.st_ino, Stat.st_size, Stat.st_mtime_ns)
+
+    def _is_same(self, SrcPath, SrcStat, PrevPath, Minify = False):
+        try:
+            prev_stat = os.stat(PrevPath)
+        except FileNotFoundError:
+            return False
+
+        if Minify:
+            # Sizes differ, but the minified file kept the source's mtime
+            key = CSync._minified_key(prev_stat)
+
+            return prev_stat.st_mtime_ns == SrcStat.st_mtime_ns \
+                and self.digests.get(key) is not None
+
+        if prev_stat.st_size != SrcStat.st_size:
+            return False
+
+        if self.use_hash:
+            return self._digest(SrcPath, SrcStat) \
+                == self._digest(PrevPath, prev_stat)
+
+        return prev_stat.st_mtime_ns == SrcStat.st_mtime_ns
+
+    @staticmethod
+    def unlink(Path):
+        # Files in siter-staging can be links to siter-static or siter-out,
+        # so they are replaced and never written through
+        try:
+            os.unlink(Path)
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def link(SrcPath, DstPath):
+        CSync.unlink(DstPath)
+
+        try:
+            os.link(SrcPath, DstPath)
+        except OSError:
+            shutil.copy2(SrcPath, DstPath)
+
+    def _copy(self, SrcPath, DstPath):
+        if self.method == 'hardlink':
+            CSync.link(SrcPath, DstPath)
+
+            return
+
+        if self.method == 'reflink' and fcntl:
+            try:
+                with open(SrcPath, 'rb') as src, open(DstPath, 'wb') as dst:
+                    fcntl.ioctl(dst.fileno(), CSync._ficlone, src.fileno())
+
+                shutil.copystat(SrcPath, DstPath)
+
+                return
+            except OSError:
+                # Not supported here, fall back to a real copy
+                pass
+
+        shutil.copy2(SrcPath, DstPath)
+
+    def sync(self, SrcDir, PrevDir, DstDir):
+        CUtil.message('Sync files',
+                      f'From {SrcDir.shortpath} to {DstDir.shortpath}')
+
+        to_minify = []
+
+        for rootdir, _, files in os.walk(SrcDir.path):
+            rel_dir = os.path.relpath(rootdir, start = SrcDir.path)
+            dst_dir = os.path.normpath(os.path.join(DstDir.path, rel_dir))
+
+            os.makedirs(dst_dir, exist_ok = True)
+
+            for f in files:
+                src_path = os.path.join(rootdir, f)
+                prev_path = os.path.normpath(
+                                os.path.join(PrevDir.path, rel_dir, f))
+                dst_path = os.path.join(dst_dir, f)
+                minify = self.minify and CMinify.for_path(f) is not None
+
+                if self._is_same(src_path,
+                                 os.stat(src_path),
+                                 prev_path,
+                                 minify):
+
+                    # Keep the previous file as it was, mtime and all
+                    CSync.link(prev_path, dst_path)
+                    self.unchanged += 1
+                elif minify:
+                    to_minify.append((src_path, dst_path))
+                else:
+                    self._copy(src_path, dst_path)
+                    self.copied += 1
+
+        if len(to_minify) > 1 and self.jobs > 1:
+            with concurrent.futures.ProcessPoolExecutor(
+                    max_workers = min(self.jobs, len(to_minify))) as pool:
+
+                results = list(pool.map(CMinify.minify_file, to_minify))
+        else:
+            results = [CMinify.minify_file(p) for p in to_minify]
+
+        for saved, stat in results:
+            # Remember the file is minified, to reuse it next time
+            self.digests.set(CSync._minified_key(stat), True)
+
+            self.saved += saved
+            self.copied += 1
+
+        if self.use_hash or self.minify:
+            self.digests.evict()
+
+class CDigests:
+    # Digests saved across runs, keyed on what changes along with a file
+    def __init__(self, Cache):
+        self.cache = Cache
+        self.keys = []
+
+    def get(self, Key):
+        self.keys.append(Key)
+
+        return self.cache.get(Key)
+
+    def set(self, Key, Value):
+        self.keys.append(Key)
+        self.cache.set(Key, Value)
+
+    def digest(self, Key, Path):
+        # Hashing is slow, remember digests of files that did not change
+        digest = self.get(Key)
+
+        if digest is None:
+            digest = CSync.hash_file(Path)
+            self.cache.set(Key, digest)
+
+        return digest
+
+    def evict(self):
+        # Forget digests of files that changed or went away
+        self.cache.evict(self.keys)
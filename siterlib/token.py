@@ -18,10 +18,15 @@
 from .settings import *
 
 class CToken:
+    # Pages have lots of tokens, so none of them get a __dict__
+    __slots__ = ()
+
     def __str__(self):
         return self.resolve()
 
 class CTokenText(CToken):
+    __slots__ = ('text',)
+
     def __init__(self, Text):
         self.text = Text
 
@@ -29,9 +34,24 @@ class CTokenText(CToken):
         return self.text
 
 class CTokenWhitespace(CTokenText):
-    pass
+    __slots__ = ()
 
 class CTokenMarker(CToken):
+    # Markers have no state, each type has one shared instance
+    __slots__ = ()
+
+    Instance = None
+
+    def __new__(Class):
+        if Class.Instance is None:
+            Class.Instance = super().__new__(Class)
+
+        return Class.Instance
+
+    def __reduce__(self):
+        # Unpickle to the shared instance too
+        return (self.__class__, ())
+
     def resolve(self):
         return self.__class__.DefaultText
 
@@ -48,35 +68,68 @@ class CTokenEscape(CTokenMarker):
     DefaultText = '\\'
 
 class CTokenBlock(CToken):
+    __slots__ = ('tokens', '_call')
+
     def __init__(self, Tokens):
         self.tokens = Tokens
 
     def resolve(self):
         return CSettings.TagOpen + self.tokens.resolve() + CSettings.TagClose
 
-    def capture_call(self):
+    def _parse_call(self):
+        # Blocks don't change after tokenizing, so parse them only once
+        try:
+            return self._call
+        except AttributeError:
+            pass
+
         # `!name ...`
-        head, _ = self.tokens.capture(CTokenEval, CTokenText)
+        head, tail = self.tokens.capture(CTokenEval, CTokenText)
+
+        if head:
+            # Name, remaining tokens, then args in multi and single arg form
+            self._call = [head.get_token(1).resolve(), tail, None, None]
+        else:
+            self._call = None
+
+        return self._call
+
+    def capture_call(self):
+        call = self._parse_call()
 
-        return head.get_token(1).resolve() if head else None
+        return call[0] if call else None
 
     def capture_args(self, SingleArg):
         # `!name {{arg1}} {{arg2}} ...`
-        _, tail = self.tokens.capture(CTokenEval, CTokenText)
+        call = self._parse_call()
 
-        if tail is None or tail.num_tokens() == 0:
+        if call is None:
             return []
 
-        args = tail.filter(CTokenBlock)
+        index = 3 if SingleArg else 2
+
+        if call[index] is None:
+            call[index] = CTokenBlock._make_args(call[1], SingleArg)
+
+        return call[index]
+
+    def _make_args(Tail, SingleArg):
+        if Tail.num_tokens() == 0:
+            return []
+
+        args = Tail.filter(CTokenBlock)
 
         if SingleArg or len(args) == 0:
             # Put all the args in a parent block
+            tail = CTokenCollection(Tail.tokens)
             tail.trim()
             args = [CTokenBlock(tail)]
 
         return args
 
 class CTokenCollection:
+    __slots__ = ('tokens',)
+
     def __init__(self, Tokens = None):
         self.tokens = Tokens if Tokens else []
 
@@ -119,6 +172,29 @@ class CTokenCollection:
 
         self.tokens = self.tokens[start : end]
 
+    def join_static(Tokens):
+        # Leading and trailing whitespace must stay trimmable
+        start = 0
+        end = len(Tokens)
+
+        while start < end and type(Tokens[start]) is CTokenWhitespace:
+            start += 1
+
+        while end > start and type(Tokens[end - 1]) is CTokenWhitespace:
+            end -= 1
+
+        static = []
+
+        for run, token_type in [(Tokens[: start], CTokenWhitespace),
+                                (Tokens[start : end], CTokenText),
+                                (Tokens[end :], CTokenWhitespace)]:
+            if len(run) == 1:
+                static.append(run[0])
+            elif len(run) > 1:
+                static.append(token_type(''.join([t.resolve() for t in run])))
+
+        return static
+
     def capture(self, *Args):
         i = 0
         head = CTokenCollection()
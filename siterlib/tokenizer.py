@@ -15,11 +15,30 @@
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import re
+
 from .settings import *
 from .token import *
 from .util import *
 
 class CTokenizer:
+    # Bump when the token tree changes, to invalidate cached tokens
+    Version = 2
+
+    # Available engines, selected with --tokenizer
+    Engines = ['char', 'scan', 'span', 'check']
+    Engine = 'char'
+
+    # Whitespace runs or any of the marker strings, leftmost first
+    _scan_markers = [CTokenTagOpen, CTokenTagClose, CTokenEval, CTokenEscape]
+    _scan_re = re.compile(r'(\s+)|' + '|'.join(
+                            [f'({re.escape(t.DefaultText)})'
+                                for t in _scan_markers]))
+
+    # Only the marker strings, for the text between blocks
+    _span_re = re.compile('|'.join([f'({re.escape(t.DefaultText)})'
+                                        for t in _scan_markers]))
+
     def _make_flat_tokens(Text):
         flat_tokens = []
         current_type = None
@@ -80,6 +99,191 @@ class CTokenizer:
 
         return flat_tokens
 
+    def _make_flat_tokens_scan(Text):
+        flat_tokens = []
+        markers = CTokenizer._scan_markers
+        pos = 0
+
+        def add_token(Token):
+            if flat_tokens \
+                and type(flat_tokens[-1]) is CTokenEscape \
+                and isinstance(Token, CTokenMarker):
+
+                flat_tokens[-1] = CTokenText(Token.DefaultText)
+            else:
+                flat_tokens.append(Token)
+
+        for match in CTokenizer._scan_re.finditer(Text):
+            start = match.start()
+
+            if start > pos:
+                # Everything between whitespace and markers is plain text
+                add_token(CTokenText(Text[pos : start]))
+
+            if match.lastindex == 1:
+                add_token(CTokenWhitespace(match.group()))
+            else:
+                add_token(markers[match.lastindex - 2]())
+
+            pos = match.end()
+
+        if pos < len(Text):
+            add_token(CTokenText(Text[pos :]))
+
+        return flat_tokens
+
+    def _make_tokens_span(Text):
+        # Like scan, but the text between top-level blocks is sliced from
+        # Text in one go instead of being split up and joined back again
+        markers = CTokenizer._scan_markers
+        top_tokens = []
+        stack = []
+        run_start = 0
+        run_cuts = []
+        escape_end = -1
+        pos = 0
+
+        def add_run(End):
+            if run_cuts:
+                # Drop the escape chars in front of escaped markers
+                pieces = []
+                start = run_start
+
+                for cut in run_cuts:
+                    pieces.append(Text[start : cut])
+                    start = cut + 1
+
+                pieces.append(Text[start : End])
+                text = ''.join(pieces)
+            else:
+                text = Text[run_start : End]
+
+            if not text:
+                return
+
+            # Same tokens as CTokenCollection.join_static would make
+            lead = len(text) - len(text.lstrip())
+
+            if lead == len(text):
+                top_tokens.append(CTokenWhitespace(text))
+
+                return
+
+            trail = len(text) - len(text.rstrip())
+
+            if lead:
+                top_tokens.append(CTokenWhitespace(text[: lead]))
+
+            top_tokens.append(CTokenText(text[lead : len(text) - trail]))
+
+            if trail:
+                top_tokens.append(CTokenWhitespace(text[len(text) - trail :]))
+
+        while True:
+            if stack:
+                match = CTokenizer._scan_re.search(Text, pos)
+            else:
+                match = CTokenizer._span_re.search(Text, pos)
+
+            if match is None:
+                break
+
+            start = match.start()
+
+            if stack:
+                if start > pos:
+                    stack[-1].tokens.add_token(CTokenText(Text[pos : start]))
+
+                if match.lastindex == 1:
+                    stack[-1].tokens.add_token(CTokenWhitespace(match.group()))
+                    pos = match.end()
+
+                    continue
+
+                marker = markers[match.lastindex - 2]
+            else:
+                marker = markers[match.lastindex - 1]
+
+            pos = match.end()
+
+            if start == escape_end:
+                # The last token was an escape, this marker is plain text
+                if stack:
+                    stack[-1].tokens.tokens[-1] = CTokenText(marker.DefaultText)
+                else:
+                    run_cuts.append(start - 1)
+
+                escape_end = -1
+            elif marker is CTokenTagOpen:
+                if not stack:
+                    add_run(start)
+
+                stack.append(CTokenBlock(CTokenCollection()))
+            elif marker is CTokenTagClose:
+                if not stack:
+                    CUtil.error('Found extra closing tag')
+
+                block = stack.pop()
+
+                if stack:
+                    stack[-1].tokens.add_token(block)
+                else:
+                    top_tokens.append(block)
+                    run_start = pos
+                    run_cuts = []
+            else:
+                if stack:
+                    stack[-1].tokens.add_token(marker())
+
+                if marker is CTokenEscape:
+                    escape_end = pos
+
+        if stack:
+            CUtil.error('Missing closing tag')
+
+        add_run(len(Text))
+
+        return CTokenCollection(top_tokens)
+
+    def _is_same_tree(Tokens, Expected, TopLevel):
+        if len(Tokens) != len(Expected):
+            return False
+
+        for t, e in zip(Tokens, Expected):
+            if type(e) is CTokenBlock:
+                if type(t) is not CTokenBlock \
+                    or not CTokenizer._is_same_tree(
+                                t.tokens.tokens, e.tokens.tokens, False):
+
+                    return False
+            elif t.resolve() != e.resolve():
+                return False
+            elif type(t) is not type(e) \
+                and not (TopLevel
+                            and type(t) is CTokenText
+                            and isinstance(e, CTokenMarker)):
+
+                # A lone marker between blocks is sliced as text
+                return False
+
+        return True
+
+    def _check_flat_tokens(Text):
+        char_tokens = CTokenizer._make_flat_tokens(Text)
+        scan_tokens = CTokenizer._make_flat_tokens_scan(Text)
+
+        for i, (c, s) in enumerate(zip(char_tokens, scan_tokens)):
+            if type(c) is not type(s) or c.resolve() != s.resolve():
+                CUtil.error(f'Tokenizer mismatch at token {i}: ' \
+                            f'{type(c).__name__} {c.resolve()!r} vs ' \
+                            f'{type(s).__name__} {s.resolve()!r}')
+
+        if len(char_tokens) != len(scan_tokens):
+            CUtil.error(f'Tokenizer mismatch: {len(char_tokens)} vs ' \
+                        f'{len(scan_tokens)} tokens')
+
+        return scan_tokens
+
     def _make_block_tokens(FlatTokens):
         stack = []
         block_tokens = CTokenCollection()
@@ -106,9 +310,53 @@ class CTokenizer:
 
         return block_tokens
 
+    def _merge_top_level(Collection):
+        # Outside of blocks only the text matters, plus the whitespace
+        # around each run that trimming might remove after evaluation
+        tokens = []
+        static = []
+
+        for token in Collection:
+            if type(token) is CTokenBlock:
+                tokens += CTokenCollection.join_static(static)
+                tokens.append(token)
+                static = []
+            else:
+                static.append(token)
+
+        tokens += CTokenCollection.join_static(static)
+
+        return CTokenCollection(tokens)
+
+    def set_engine(Name):
+        if Name not in CTokenizer.Engines:
+            CUtil.error(f'Unknown tokenizer {Name}, ' \
+                        f'use one of {", ".join(CTokenizer.Engines)}')
+
+        CTokenizer.Engine = Name
+
     def tokenize(Text):
-        flat_tokens = CTokenizer._make_flat_tokens(Text)
+        if CTokenizer.Engine == 'span':
+            return CTokenizer._make_tokens_span(Text)
+
+        if CTokenizer.Engine == 'scan':
+            flat_tokens = CTokenizer._make_flat_tokens_scan(Text)
+        elif CTokenizer.Engine == 'check':
+            flat_tokens = CTokenizer._check_flat_tokens(Text)
+        else:
+            flat_tokens = CTokenizer._make_flat_tokens(Text)
+
         block_tokens = CTokenizer._make_block_tokens(flat_tokens)
+        block_tokens = CTokenizer._merge_top_level(block_tokens)
+
+        if CTokenizer.Engine == 'check':
+            span_tokens = CTokenizer._make_tokens_span(Text)
+
+            if not CTokenizer._is_same_tree(span_tokens.tokens,
+                                            block_tokens.tokens,
+                                            True):
+
+                CUtil.error('Tokenizer mismatch between span and scan trees')
 
         return block_tokens
 
@@ -15,20 +15,46 @@
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-import sys, time, traceback
-import http.server, os, socketserver, subprocess, threading
+import os, sys, time, traceback
 
 class CUtil:
+    # Messages go here instead of stdout while capturing
+    _captured = None
+
     @staticmethod
     def message(Title, Content, Color = 2):
         space = max(2, 12 - len(Title))
         head = '■' * (space // 2)
         tail = '■' * (space - space // 2)
+        line = f'\033[{30 + Color};1m{head} {Title} {tail}\033[0m {Content}'
+
+        if CUtil._captured is None:
+            print(line)
+        else:
+            CUtil._captured.append(line)
+
+    @staticmethod
+    def capture_begin():
+        CUtil._captured = []
+
+    @staticmethod
+    def capture_end():
+        lines = CUtil._captured
+        CUtil._captured = None
+
+        return lines
 
-        print(f'\033[{30 + Color};1m{head} {Title} {tail}\033[0m {Content}')
+    @staticmethod
+    def replay(Lines):
+        for line in Lines:
+            print(line)
 
     @staticmethod
     def error(Message):
+        if CUtil._captured is not None:
+            # Show what led to the error
+            CUtil.replay(CUtil.capture_end())
+
         CUtil.message('Error', Message, 1)
         CUtil.message('Call Stack', '', 1)
         traceback.print_stack()
@@ -55,35 +81,3 @@ class CUtil:
             os.chdir(Path)
         except FileNotFoundError:
             CUtil.error(f'Invalid path {Path}')
-
-    @staticmethod
-    def run_server(RootPath):
-        os.chdir(RootPath)
-
-        host = 'localhost'
-        port = 0
-        server = socketserver.TCPServer(
-                    (host, port), http.server.SimpleHTTPRequestHandler)
-
-        with server:
-            host, port = server.server_address
-            url = f'http://{host}:{port}'
-
-            server_thread = threading.Thread(target = server.serve_forever)
-            server_thread.start()
-
-            CUtil.info(f'Web server running at {url}')
-
-            cmd = f'xdg-open {url}'
-            status, output = subprocess.getstatusoutput(cmd)
-
-            for line in output.splitlines():
-                CUtil.message('Browser', line)
-
-            if status != 0:
-                sys.exit(status)
-
-            input('\nPress ENTER to exit web server\n\n')
-
-            server.shutdown()
-            server_thread.join()
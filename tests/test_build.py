@@ -0,0 +1,368 @@
+"""
+    Copyright 2011 Alex Margarit
+    This file is part of Siter, a static website generator.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License version 3,
+    as published by the Free Software Foundation.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os, shutil, subprocess, sys, tempfile, unittest
+
+from siterlib.siter import *
+
+class CTestBuild(unittest.TestCase):
+    RepoPath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    Project = {
+        'siter-template/page.html':
+            '<html><body>{{!siter-md {{!siter-content}}}}</body></html>\n',
+        'siter-template/item.html': '<li>{{!siter-content}}</li>\n',
+        'siter-pages/index.md': '# Home\n\n{{!greeting}}\n',
+    }
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path, True)
+
+        self._write(CTestBuild.Project)
+
+    def _write(self, Files, Root = None):
+        for name, text in Files.items():
+            path = os.path.join(Root or self.path, name)
+            os.makedirs(os.path.dirname(path), exist_ok = True)
+
+            with open(path, 'w') as f:
+                f.write(text)
+
+    def _remove(self, Name):
+        os.remove(os.path.join(self.path, Name))
+
+    def _run(self, *Args, Path = None):
+        env = dict(os.environ)
+        env['PYTHONPATH'] = CTestBuild.RepoPath
+
+        return subprocess.run([sys.executable, '-m', 'siterlib', *Args],
+                              cwd = Path or self.path,
+                              env = env,
+                              stdout = subprocess.PIPE,
+                              stderr = subprocess.STDOUT,
+                              text = True)
+
+    def _gen(self, *Args, Path = None):
+        result = self._run('gen', '.', *Args, Path = Path)
+        self.assertEqual(result.returncode, 0, result.stdout)
+
+        return result.stdout
+
+    def _output(self, Path = None):
+        out_path = os.path.join(Path or self.path, 'siter-out')
+        files = {}
+
+        for rootdir, _, names in os.walk(out_path):
+            for name in names:
+                path = os.path.join(rootdir, name)
+
+                with open(path, 'rb') as f:
+                    files[os.path.relpath(path, start = out_path)] = f.read()
+
+        return files
+
+    def _fresh_output(self):
+        # Same sources, built with nothing to reuse
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path, True)
+
+        for name in os.listdir(self.path):
+            if name.startswith('siter-') and name != 'siter-out':
+                shutil.copytree(os.path.join(self.path, name),
+                                os.path.join(path, name))
+
+        self._gen('--no-cache', Path = path)
+
+        return self._output(path)
+
+    def _check(self, *Args):
+        log = self._gen(*Args)
+        self.assertEqual(self._output(), self._fresh_output())
+
+        return log
+
+    def test_paginate_in_memoized_macro(self):
+        self._write({
+            'siter-config/defs.md':
+                '{{!siter-def {{greeting}} {{Hi}}}}\n'
+                '{{!siter-def {{news}} {{}} '
+                '{{{{!siter-paginate {{news}} {{item.html}} {{2}}}}}}}}\n',
+            'siter-pages/a/news.md': '{{!news}}\n',
+            'siter-pages/b/news.md': '{{!news}}\n',
+            **{f'siter-foreach/news/n{i}.md': f'Story {i}\n'
+                for i in range(1, 6)},
+        })
+
+        self._check('--memoize', '100')
+
+        for page in ['a/news', 'b/news']:
+            for name in ['.html', '-2.html', '-3.html']:
+                self.assertIn(page + name, self._output())
+
+    def test_watch_rebuild_after_error(self):
+        self._write({
+            'siter-config/defs.md': '{{!siter-def {{greeting}} {{Hi}}}}\n',
+            'siter-pages/sub/deep/d.md': 'Deep\n',
+        })
+
+        cwd = os.getcwd()
+        self.addCleanup(os.chdir, cwd)
+
+        siter = CSiter(['siter', 'gen', self.path, '--jobs', '1'])
+        siter.options['incremental'] = True
+
+        # A template edit saved along with a broken page
+        self._write({
+            'siter-template/page.html': '<main>{{!siter-content}}</main>\n',
+            'siter-pages/sub/deep/d.md': '{{!greeting\n',
+        })
+
+        self.assertFalse(siter._rebuild())
+
+        self._write({'siter-pages/sub/deep/d.md': 'Deep again\n'})
+
+        self.assertTrue(siter._rebuild())
+        self.assertEqual(self._output(), self._fresh_output())
+
+    def test_serve_rejects_watch(self):
+        result = self._run('serve', '.', '--watch')
+
+        self.assertNotEqual(result.returncode, 0)
+        self.assertIn('siter run --watch', result.stdout)
+
+    def test_incremental_edits(self):
+        self._write({
+            'siter-config/defs.md': '{{!siter-def {{greeting}} {{Hi}}}}\n',
+            'siter-pages/list.md': '{{!siter-foreach {{list}} {{item.html}}}}\n',
+            'siter-pages/news.md':
+                '{{!siter-paginate {{list}} {{item.html}} {{2}}}}\n'
+                '{{!siter-page-next}}\n',
+            'siter-pages/sub/about.md': 'About {{!greeting}}\n',
+            **{f'siter-foreach/list/n{i}.md': f'Story {i}\n'
+                for i in range(1, 6)},
+        })
+
+        self._check('--incremental')
+
+        # Template
+        self._write({
+            'siter-template/page.html': '<main>{{!siter-content}}</main>\n',
+        })
+
+        self._check('--incremental')
+
+        # Config
+        self._write({
+            'siter-config/defs.md': '{{!siter-def {{greeting}} {{Hello}}}}\n',
+        })
+
+        self._check('--incremental')
+
+        # A new stub, one more page to paginate
+        self._write({'siter-foreach/list/n6.md': 'Story 6\n'})
+
+        self._check('--incremental')
+
+        # Fewer stubs, two pages fewer
+        for i in range(3, 7):
+            self._remove(f'siter-foreach/list/n{i}.md')
+
+        self._check('--incremental')
+
+        # Stub template
+        self._write({'siter-template/item.html': '<p>{{!siter-content}}</p>\n'})
+
+        self._check('--incremental')
+
+    def test_memoize_edits(self):
+        # Same arguments everywhere, but the macro also reads bindings
+        # that differ from page to page
+        self._write({
+            'siter-config/defs.md':
+                '{{!siter-def {{greeting}} {{Hi}}}}\n'
+                '{{!siter-def {{who}} {{all}}}}\n'
+                '{{!siter-def {{card}} {{t}} '
+                '{{<b>{{!t}}</b> {{!who}} {{!siter-root}}}}}}\n',
+            'siter-pages/a.md': '{{!card {{x}}}} {{!card {{y}}}}\n',
+            'siter-pages/b.md':
+                '{{!siter-def {{who}} {{b}}}}{{!card {{x}}}}\n',
+            'siter-pages/sub/c.md': '{{!card {{x}}}}\n',
+            'siter-pages/sub/d.md':
+                '{{!card {{x}}}}{{!siter-def {{who}} {{d}}}}{{!card {{x}}}}\n',
+        })
+
+        self._check('--memoize', '100')
+
+        self._write({
+            'siter-config/defs.md':
+                '{{!siter-def {{greeting}} {{Hi}}}}\n'
+                '{{!siter-def {{who}} {{everyone}}}}\n'
+                '{{!siter-def {{card}} {{t}} {{<i>{{!t}}</i> {{!who}}}}}}\n',
+        })
+
+        self._check('--memoize', '100', '--incremental')
+
+    def test_stub_cache_edits(self):
+        # Stubs read a config binding, and one set by the listing page
+        self._write({
+            'siter-config/defs.md':
+                '{{!siter-def {{greeting}} {{Hi}}}}\n'
+                '{{!siter-def {{tag}} {{new}}}}\n',
+            'siter-template/item.html':
+                '<li>{{!siter-content}} {{!tag}} {{!siter-root}}</li>\n',
+            'siter-pages/a.md': '{{!siter-foreach {{list}} {{item.html}}}}\n',
+            'siter-pages/c.md':
+                '{{!siter-def {{tag}} {{old}}}}'
+                '{{!siter-foreach {{list}} {{item.html}}}}\n',
+            'siter-pages/sub/b.md':
+                '{{!siter-def {{tag}} {{old}}}}'
+                '{{!siter-foreach {{list}} {{item.html}}}}\n',
+            **{f'siter-foreach/list/n{i}.md': f'Story {i} {{{{!greeting}}}}\n'
+                for i in range(1, 4)},
+        })
+
+        self._check()
+
+        # Pages share stubs within a build too, so check what they made
+        output = self._output()
+
+        self.assertIn(b'<li>Story 1 Hi new .</li>', output['a.html'])
+        self.assertIn(b'<li>Story 1 Hi old .</li>', output['c.html'])
+        self.assertIn(b'<li>Story 1 Hi old ..</li>', output['sub/b.html'])
+
+        # A stub, the others come from the cache
+        self._write({'siter-foreach/list/n2.md': 'Story two\n'})
+
+        self.assertIn('Stubs reused', self._check())
+
+        # A binding read by stubs
+        self._write({
+            'siter-config/defs.md':
+                '{{!siter-def {{greeting}} {{Hello}}}}\n'
+                '{{!siter-def {{tag}} {{newer}}}}\n',
+        })
+
+        self._check()
+
+        # The listing page's own binding
+        self._write({
+            'siter-pages/sub/b.md':
+                '{{!siter-def {{tag}} {{older}}}}'
+                '{{!siter-foreach {{list}} {{item.html}}}}\n',
+        })
+
+        self._check()
+
+        # The stub template
+        self._write({'siter-template/item.html': '<p>{{!siter-content}}</p>\n'})
+
+        self._check()
+
+    def test_constants_edits(self):
+        # Globals that read other globals, pages that override those, and
+        # a global that reads where the page is
+        self._write({
+            'siter-config/defs.md':
+                '{{!siter-def {{greeting}} {{Hi}}}}\n'
+                '{{!siter-def {{site}} {{Home}}}}\n'
+                '{{!siter-def {{title}} {{{{!greeting}} {{!site}}}}}}\n'
+                '{{!siter-def {{up}} {{{{!siter-root}}/index.html}}}}\n',
+            'siter-template/page.html':
+                '{{!title}} {{!up}} {{!siter-content}}\n',
+            'siter-pages/a.md': '{{!title}}\n',
+            'siter-pages/b.md': '{{!siter-def {{site}} {{B}}}}{{!title}}\n',
+            'siter-pages/sub/c.md': '{{!title}} {{!up}}\n',
+        })
+
+        # Every build evaluates constants once, so check what they made
+        self.assertIn('Constant variables reused', self._gen())
+
+        output = self._output()
+
+        self.assertEqual(output['a.html'], b'Hi Home ./index.html Hi Home\n')
+        self.assertEqual(output['b.html'], b'Hi B ./index.html Hi B\n')
+        self.assertEqual(output['sub/c.html'],
+                         b'Hi Home ../index.html Hi Home ../index.html\n')
+
+        self._write({
+            'siter-config/defs.md':
+                '{{!siter-def {{greeting}} {{Hello}}}}\n'
+                '{{!siter-def {{site}} {{Start}}}}\n'
+                '{{!siter-def {{title}} {{{{!site}}: {{!greeting}}}}}}\n'
+                '{{!siter-def {{up}} {{{{!siter-root}}/a.html}}}}\n',
+        })
+
+        self._check('--incremental')
+
+    def test_config_snapshot_edits(self):
+        self._write({
+            'siter-config/defs.md':
+                '{{!siter-def {{greeting}} {{Hi}}}}\n'
+                '{{!siter-def {{shout}} {{t}} {{<b>{{!t}}</b>}}}}\n',
+            'siter-pages/a.md': '{{!shout {{{{!greeting}}}}}}\n',
+        })
+
+        self._check()
+        self.assertIn('Snapshot', self._check())
+
+        # Edit a config file
+        self._write({
+            'siter-config/defs.md':
+                '{{!siter-def {{greeting}} {{Hello}}}}\n'
+                '{{!siter-def {{shout}} {{t}} {{<i>{{!t}}</i>}}}}\n',
+        })
+
+        self._check()
+
+        # Add one that overrides the other
+        self._write({
+            'siter-config/more.md': '{{!siter-def {{greeting}} {{Hey}}}}\n',
+        })
+
+        self._check()
+
+        # Then take it away
+        self._remove('siter-config/more.md')
+
+        self._check()
+
+    def test_config_watch_edits(self):
+        self._write({
+            'siter-config/defs.md': '{{!siter-def {{greeting}} {{Hi}}}}\n',
+        })
+
+        cwd = os.getcwd()
+        self.addCleanup(os.chdir, cwd)
+
+        siter = CSiter(['siter', 'gen', self.path, '--jobs', '1'])
+
+        # Same config, kept from the last build
+        self._write({'siter-pages/index.md': '{{!greeting}} again\n'})
+
+        self.assertTrue(siter._rebuild())
+        self.assertEqual(self._output(), self._fresh_output())
+
+        self._write({
+            'siter-config/defs.md': '{{!siter-def {{greeting}} {{Hello}}}}\n',
+        })
+
+        self.assertTrue(siter._rebuild())
+        self.assertEqual(self._output(), self._fresh_output())
+
+if __name__ == '__main__':
+    unittest.main()
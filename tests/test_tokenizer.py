@@ -0,0 +1,126 @@
+"""
+    Copyright 2011 Alex Margarit
+    This file is part of Siter, a static website generator.
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License version 3,
+    as published by the Free Software Foundation.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import random, unittest
+from unittest import mock
+
+from siterlib.token import *
+from siterlib.tokenizer import *
+from siterlib.util import *
+
+class CTokenizeError(Exception):
+    pass
+
+class CTestTokenizer(unittest.TestCase):
+    # Texts the engines must agree on, including the malformed ones
+    Corpus = [
+        '',
+        'plain text',
+        '  leading and trailing  \n',
+        '{{a}}',
+        '{{!a}}',
+        '{{!a {{b}} {{c d}}}}',
+        '{{!a\n  {{b}}\n}}',
+        '{{ }}',
+        '{{\n\t}}',
+        '{{}}',
+        'x {{}} y',
+        r'\{{not a block}}',
+        r'\\{{a}}',
+        r'\\\{{a}}',
+        r'\!',
+        r'{{\!a}}',
+        r'a \ b \\ c',
+        '!',
+        '! {{a}} !',
+        '{{!a}} ! {{!b}}',
+        '{{!a}}!{{!b}}',
+        '{{!a}} {{!b}}',
+        '{',
+        '}',
+        'a { b } c',
+        '{{a',
+        'a}}',
+        '{{a}}}}',
+        '{{{{a}}',
+        '}}{{',
+        '{{!a {{b}}',
+    ]
+
+    # Pieces of random texts, weighted towards the tricky ones
+    Pieces = ['{{', '}}', '{{!', '!', '\\', '\\\\', '{', '}',
+              ' ', '  ', '\n', '\t', 'a', 'bc', 'x y']
+
+    def _tokenize(self, Engine, Text):
+        engine = CTokenizer.Engine
+        CTokenizer.set_engine(Engine)
+
+        try:
+            with mock.patch.object(CUtil, 'error', side_effect = CTokenizeError):
+                return CTokenizer.tokenize(Text)
+        except CTokenizeError:
+            return None
+        finally:
+            CTokenizer.Engine = engine
+
+    def _shape(self, Tokens):
+        return [(type(t).__name__, self._shape(t.tokens.tokens))
+                    if type(t) is CTokenBlock
+                    else (type(t).__name__, t.resolve())
+                        for t in Tokens]
+
+    def _check(self, Text):
+        char = self._tokenize('char', Text)
+        scan = self._tokenize('scan', Text)
+        span = self._tokenize('span', Text)
+
+        if char is None:
+            self.assertIsNone(scan, repr(Text))
+            self.assertIsNone(span, repr(Text))
+
+            return
+
+        self.assertIsNotNone(scan, repr(Text))
+        self.assertIsNotNone(span, repr(Text))
+
+        self.assertEqual(self._shape(char.tokens),
+                         self._shape(scan.tokens),
+                         repr(Text))
+
+        # Span slices lone top-level markers as text, which resolves the same
+        self.assertTrue(CTokenizer._is_same_tree(span.tokens,
+                                                 char.tokens,
+                                                 True),
+                        repr(Text))
+
+    def test_corpus(self):
+        for text in CTestTokenizer.Corpus:
+            with self.subTest(text = text):
+                self._check(text)
+
+    def test_random(self):
+        rand = random.Random(2011)
+
+        for _ in range(3000):
+            text = ''.join(rand.choice(CTestTokenizer.Pieces)
+                            for _ in range(rand.randint(0, 24)))
+
+            with self.subTest(text = text):
+                self._check(text)
+
+if __name__ == '__main__':
+    unittest.main()